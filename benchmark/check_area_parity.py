@@ -0,0 +1,103 @@
+"""
+Parity check of the area backends on synthetic overlapping labels: class areas of the "analytic" and "raster"
+backends are compared with the index render of sly.Annotation.draw_class_idx_rgb (the original calculation,
+later labels overwrite earlier ones). Rectangles and bitmaps must be pixel-exact, analytic areas of polygons
+are the pixel regions of their scanline fill and may differ by up to --polygon-tolerance pixels per polygon:
+
+    python benchmark/check_area_parity.py --images 200 --labels 5-40
+
+Exits with code 1 if any image differs by more than the tolerance
+"""
+import argparse
+import json
+import os
+import random
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import area
+from run_benchmark import _range, _size
+from synthetic import generate_annotation, generate_meta
+
+# rectangles / polygons and bitmaps are calculated analytically, vector labels overlapping bitmaps fall back
+# to raster; mix -> whether analytic areas are pixel-exact
+GEOMETRY_MIXES = {
+    "rectangle:1": True,
+    "bitmap:1": True,
+    "rectangle:0.5,bitmap:0.5": True,
+    "polygon:1": False,
+    "rectangle:0.5,polygon:0.5": False,
+    "rectangle:0.4,polygon:0.4,bitmap:0.2": False,
+}
+
+
+def _render_areas(ann, class_names, name_to_index):
+    render = np.zeros(ann.img_size + (3,), dtype=np.uint8)
+    ann.draw_class_idx_rgb(render, name_to_index)
+    return {name: int(np.count_nonzero(render[:, :, 0] == name_to_index[name])) for name in class_names}
+
+
+def _backend_areas(ann, class_names, name_to_index, backend):
+    stat = area.stat_area(ann, class_names, name_to_index, percent=False, backend=backend)
+    return {name: stat[name] for name in class_names}
+
+
+def check(args):
+    rnd = random.Random(args.seed)
+    result = {}
+    for mix, exact in GEOMETRY_MIXES.items():
+        meta = generate_meta(args.classes, 0, mix)
+        class_names = [obj_class.name for obj_class in meta.obj_classes]
+        name_to_index = {name: idx + 1 for idx, name in enumerate(class_names)}
+        mismatches, analytic_images, max_error = [], 0, 0
+        for image_idx in range(args.images):
+            height, width = args.image_size
+            ann = generate_annotation(meta, height, width, rnd.randint(*args.labels), mix, rnd)
+            if area._analytic_class_areas(ann, name_to_index) is not None:
+                analytic_images += 1
+            expected = _render_areas(ann, class_names, name_to_index)
+            polygons = {name: 0 for name in class_names}
+            for label in ann.labels:
+                if label.geometry.geometry_name() == "polygon":
+                    polygons[label.obj_class.name] += 1
+            for backend in [area.ANALYTIC, area.RASTER]:
+                actual = _backend_areas(ann, class_names, name_to_index, backend)
+                # overlapping labels of other classes move the error of a polygon to their areas too
+                tolerance = 1e-6 if exact or backend == area.RASTER else \
+                    args.polygon_tolerance * sum(polygons.values())
+                errors = {name: abs(expected[name] - actual[name]) for name in class_names}
+                if backend == area.ANALYTIC:
+                    max_error = max(max_error, *errors.values())
+                diff = {name: (expected[name], actual[name]) for name in class_names if errors[name] > tolerance}
+                if len(diff) != 0:
+                    mismatches.append({"image": image_idx, "backend": backend, "expected_actual": diff})
+        result[mix] = {"images": args.images, "analytic_images": analytic_images, "exact": exact,
+                       "max_analytic_error_px": round(max_error, 2),
+                       "mismatches": len(mismatches), "examples": mismatches[:3]}
+    return result
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Analytic/raster area parity on overlapping labels")
+    parser.add_argument("--images", type=int, default=100, help="images per geometry mix")
+    parser.add_argument("--image-size", type=_size, default=(240, 320), help="HxW")
+    parser.add_argument("--labels", type=_range, default=(5, 40), help="labels per image: N or MIN-MAX")
+    parser.add_argument("--classes", type=int, default=4)
+    parser.add_argument("--polygon-tolerance", type=float, default=8,
+                        help="allowed difference of analytic class area, pixels per polygon on the image")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+
+def main():
+    result = check(parse_args())
+    print(json.dumps(result, indent=4))
+    if any(mix_result["mismatches"] != 0 for mix_result in result.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Accuracy check of the quantile sketch (src/sketch.py): rank error of the estimated quantiles on synthetic values,
+for one sketch fed by batches and for a sketch merged from parts (as shards and checkpoints do), after a json
+round trip (to_dict / from_dict):
+
+    python benchmark/check_sketch.py --values 200000 --parts 8
+
+Rank error of a quantile estimate is |rank of the estimate / n - q|, max over q in 0.01..0.99 is reported.
+Exits with code 1 if it's above --max-rank-error (2 % by default, the expected error of k=200 is ~1 %)
+"""
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from sketch import QuantileSketch
+
+QS = np.linspace(0.01, 0.99, 99)
+
+# area % like values, object counts with many duplicates, heavy tail, sorted stream (worst order for compaction)
+DISTRIBUTIONS = {
+    "uniform": lambda rng, n: rng.uniform(0, 100, n),
+    "counts": lambda rng, n: rng.poisson(3, n).astype(np.float64),
+    "lognormal": lambda rng, n: rng.lognormal(2, 1.5, n),
+    "sorted": lambda rng, n: np.sort(rng.uniform(0, 100, n)),
+}
+
+
+def _rank_error(values, estimates):
+    # values with duplicates have a range of ranks, error is the distance from q to that range
+    values = np.sort(values)
+    low = np.searchsorted(values, estimates, side='left') / len(values)
+    high = np.searchsorted(values, estimates, side='right') / len(values)
+    return float(np.max(np.maximum(np.maximum(low - QS, QS - high), 0)))
+
+
+def _sketch(values, k, batch_size, seed):
+    sketch = QuantileSketch(k, seed=seed)
+    for start in range(0, len(values), batch_size):
+        sketch.update(values[start:start + batch_size])
+    return sketch
+
+
+def check(args):
+    rng = np.random.default_rng(args.seed)
+    result = {}
+    for name, generate in DISTRIBUTIONS.items():
+        values = generate(rng, args.values)
+        single = _sketch(values, args.k, args.batch_size, args.seed)
+
+        parts = np.array_split(values, args.parts)
+        merged = QuantileSketch.from_dict(json.loads(json.dumps(_sketch(parts[0], args.k, args.batch_size,
+                                                                        args.seed).to_dict())))
+        for idx, part in enumerate(parts[1:]):
+            part_sketch = _sketch(part, args.k, args.batch_size, args.seed + idx + 1)
+            merged.merge(QuantileSketch.from_dict(json.loads(json.dumps(part_sketch.to_dict()))))
+
+        result[name] = {
+            "n": merged.n,
+            "items": sum(len(items) for items in merged.levels),
+            "single_rank_error": round(_rank_error(values, single.quantiles(QS)), 4),
+            "merged_rank_error": round(_rank_error(values, merged.quantiles(QS)), 4),
+        }
+    return result
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Rank error of the quantile sketch, single and merged")
+    parser.add_argument("--values", type=int, default=200000)
+    parser.add_argument("--parts", type=int, default=8, help="number of merged sketches")
+    parser.add_argument("--batch-size", type=int, default=1000, help="values per update")
+    parser.add_argument("--k", type=int, default=200)
+    parser.add_argument("--max-rank-error", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    result = check(args)
+    print(json.dumps(result, indent=4))
+    if any(values["n"] != args.values or max(values["single_rank_error"], values["merged_rank_error"]) >
+           args.max_rank_error for values in result.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+In-process stand-in for the parts of sly.Api used by the app. Every call sleeps `latency` seconds
+to emulate HTTP round trips, so download/compute overlapping can be checked locally:
+
+    api = FakeApi(project, meta_json, {dataset: [(image_info, ann_json), ...]}, latency=0.05)
+    for dataset, images_count, batch, ann_jsons, _ in AnnotationPrefetcher(api, api.dataset.get_list(project.id)):
+        ...
+"""
+import json
+import time
+from collections import namedtuple
+
+import supervisely_lib as sly
+
+ProjectInfo = namedtuple('ProjectInfo', ['id', 'name', 'type', 'workspace_id', 'images_count'])
+WorkspaceInfo = namedtuple('WorkspaceInfo', ['id', 'name', 'team_id'])
+TeamInfo = namedtuple('TeamInfo', ['id', 'name'])
+DatasetInfo = namedtuple('DatasetInfo', ['id', 'name', 'project_id', 'images_count'])
+ImageInfo = namedtuple('ImageInfo', ['id', 'name', 'dataset_id', 'height', 'width', 'labels_count', 'updated_at'])
+AnnotationInfo = namedtuple('AnnotationInfo', ['image_id', 'image_name', 'annotation', 'updated_at'])
+
+
+class _FakeModule:
+    def __init__(self, parent):
+        self._parent = parent
+
+    def _wait(self):
+        self._parent.calls[type(self).__name__] = self._parent.calls.get(type(self).__name__, 0) + 1
+        if self._parent.latency > 0:
+            time.sleep(self._parent.latency)
+
+
+class _ProjectApi(_FakeModule):
+    def get_info_by_id(self, id):
+        self._wait()
+        return self._parent.project_info if id == self._parent.project_info.id else None
+
+    def get_info_by_name(self, parent_id, name):
+        self._wait()
+        project = self._parent.project_info
+        return project if parent_id == project.workspace_id and name == project.name else None
+
+    def get_meta(self, id):
+        self._wait()
+        return self._parent.meta_json
+
+    def get_images_count(self, id):
+        self._wait()
+        return sum(len(items) for items in self._parent.datasets.values())
+
+
+class _WorkspaceApi(_FakeModule):
+    def get_info_by_id(self, id):
+        self._wait()
+        return self._parent.workspace_info
+
+
+class _TeamApi(_FakeModule):
+    def get_info_by_id(self, id):
+        self._wait()
+        return self._parent.team_info
+
+
+class _DatasetApi(_FakeModule):
+    def get_list(self, project_id):
+        self._wait()
+        return list(self._parent.datasets.keys())
+
+
+class _ImageApi(_FakeModule):
+    def get_list(self, dataset_id):
+        self._wait()
+        return [info for info, _ in self._parent.datasets[self._parent.dataset_by_id[dataset_id]]]
+
+    def url(self, team_id, workspace_id, project_id, dataset_id, image_id):
+        return "http://localhost/app/images/{}/{}/{}/{}#image-{}".format(team_id, workspace_id, project_id,
+                                                                         dataset_id, image_id)
+
+
+class _AnnotationApi(_FakeModule):
+    def download_batch(self, dataset_id, image_ids):
+        self._wait()
+        results = []
+        for image_id in image_ids:
+            info, ann_json = self._parent.images[image_id]
+            results.append(AnnotationInfo(image_id=info.id, image_name=info.name, annotation=ann_json,
+                                          updated_at=info.updated_at))
+        return results
+
+
+class _FakeResponse:
+    def __init__(self, content):
+        self.content = content
+
+
+class _PostApi(_FakeModule):
+    def post(self, method, data):
+        # raw endpoint used by fast_ann.download_raw_batch
+        if method != 'annotations.bulk.info':
+            raise NotImplementedError(method)
+        self._wait()
+        results = []
+        for image_id in data['imageIds']:
+            info, ann_json = self._parent.images[image_id]
+            results.append({"imageId": info.id, "imageName": info.name, "annotation": ann_json,
+                            "updatedAt": info.updated_at})
+        return _FakeResponse(json.dumps(results).encode())
+
+
+class _ReportApi(_FakeModule):
+    # widgets of the report script (src/py_script.py) are kept as plain dicts
+    def _widget(self, widget_type, *args, **kwargs):
+        return {"type": widget_type, "args": args, "kwargs": kwargs}
+
+    def create_plotly(self, *args, **kwargs):
+        return self._widget("plotly", *args, **kwargs)
+
+    def create_table(self, *args, **kwargs):
+        return self._widget("table", *args, **kwargs)
+
+    def create_notification(self, *args, **kwargs):
+        return self._widget("notification", *args, **kwargs)
+
+    def create(self, team_id, name, widgets):
+        self._wait()
+        self._parent.reports.append((name, widgets))
+        return len(self._parent.reports)
+
+    def url(self, report_id):
+        return "http://localhost/reports/{}".format(report_id)
+
+
+class _AppApi(_FakeModule):
+    def set_data(self, task_id, data, field, append=False):
+        self._wait()
+        self._parent.pushed.append((field, data, append))
+
+
+class FakeApi:
+    def __init__(self, project: ProjectInfo, meta_json, datasets, latency=0.0, workspace=None, team=None):
+        """datasets: {DatasetInfo: [(ImageInfo, annotation json), ...]}"""
+        self.project_info = project
+        self.meta_json = meta_json
+        self.datasets = datasets
+        self.latency = latency
+        self.team_info = sly.take_with_default(team, TeamInfo(id=1, name="team"))
+        self.workspace_info = sly.take_with_default(workspace, WorkspaceInfo(id=project.workspace_id,
+                                                                             name="workspace",
+                                                                             team_id=self.team_info.id))
+        self.dataset_by_id = {dataset.id: dataset for dataset in datasets}
+        self.images = {info.id: (info, ann_json) for items in datasets.values() for info, ann_json in items}
+
+        self.calls = {}
+        self.pushed = []
+        self.reports = []
+
+        self.project = _ProjectApi(self)
+        self.workspace = _WorkspaceApi(self)
+        self.team = _TeamApi(self)
+        self.dataset = _DatasetApi(self)
+        self.image = _ImageApi(self)
+        self.annotation = _AnnotationApi(self)
+        self.app = _AppApi(self)
+        self.report = _ReportApi(self)
+        self._post = _PostApi(self)
+
+    def post(self, method, data):
+        return self._post.post(method, data)
@@ -0,0 +1,97 @@
+"""
+Annotation parsing benchmark on the real calculation path: ImageStats.calc of raw annotation json with
+sly.Annotation (fastParse off) vs fast_ann.FastAnnotation (fastParse on) on synthetic annotations:
+
+    python benchmark/parse_benchmark.py --images 500 --labels 20-100
+
+Both paths decode json with the same decoder (fast_ann.loads, orjson if it's installed), build the geometries
+of all labels (areas are drawn, object sizes use every geometry) and return identical rows; memo of identical
+annotations is disabled. Prints images/sec, time of the "parse" stage and of the whole calc and peak allocated
+KB per image (tracemalloc). FastAnnotation builds geometries lazily, i.e. in the area stage, so its "parse" time
+is not comparable with the one of sly.Annotation: compare calc time
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import area
+import fast_ann
+from image_stats import ImageStats
+from instrumentation import Instrumentation
+from run_benchmark import _range, _size
+from synthetic import generate_annotation, generate_meta
+
+
+def _image_stats(meta, fast_parse, area_backend, instrumentation=None):
+    return ImageStats(meta, area_backend=area_backend, fast_parse=fast_parse, memo_mb=0,
+                      instrumentation=instrumentation)
+
+
+def _measure(meta, raws, fast_parse, area_backend):
+    instrumentation = Instrumentation()
+    image_stats = _image_stats(meta, fast_parse, area_backend, instrumentation)
+    results = []
+    start = time.perf_counter()
+    for raw in raws:
+        results.append(image_stats.calc(raw))
+    elapsed = time.perf_counter() - start
+    parse_sec = instrumentation.stages.get("parse", [0, 0, 0])[0]
+
+    # peak memory of one image, measured in a separate pass (tracemalloc slows down the timed one)
+    image_stats = _image_stats(meta, fast_parse, area_backend)
+    tracemalloc.start()
+    peak_sum = 0
+    for raw in raws:
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        image_stats.calc(raw)
+        peak_sum += tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    return results, {
+        "images_per_sec": round(len(raws) / elapsed, 1) if elapsed > 0 else None,
+        "parse_ms_per_image": round(parse_sec * 1000 / len(raws), 3),
+        "calc_ms_per_image": round(elapsed * 1000 / len(raws), 3),
+        "peak_kb_per_image": round(peak_sum / 1024 / len(raws), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Annotation parsing benchmark")
+    parser.add_argument("--images", type=int, default=300)
+    parser.add_argument("--image-size", type=_size, default=(1080, 1920), help="HxW")
+    parser.add_argument("--labels", type=_range, default=(0, 50), help="labels per image: N or MIN-MAX")
+    parser.add_argument("--classes", type=int, default=10)
+    parser.add_argument("--tags", type=int, default=3)
+    parser.add_argument("--mix", default="rectangle:0.5,polygon:0.4,bitmap:0.1", help="geometry mix")
+    parser.add_argument("--area-backend", default=area.RASTER, choices=area.AREA_BACKENDS)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    meta = generate_meta(args.classes, args.tags, args.mix)
+    height, width = args.image_size
+    # raw bytes as they are downloaded by the pipeline
+    raws = [fast_ann.dumps(generate_annotation(meta, height, width, rnd.randint(*args.labels), args.mix,
+                                               rnd).to_json())
+            for _ in range(args.images)]
+
+    sly_results, sly_stats = _measure(meta, raws, False, args.area_backend)
+    fast_results, fast_stats = _measure(meta, raws, True, args.area_backend)
+    result = {
+        "orjson": fast_ann.orjson is not None,
+        "area_backend": args.area_backend,
+        "sly.Annotation": sly_stats,
+        "FastAnnotation": fast_stats,
+        "same_results": sly_results == fast_results,
+    }
+    print(json.dumps(result, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Benchmark of the stats pipeline (src/report.py) on a synthetic project with the in-process FakeApi:
+
+    python benchmark/run_benchmark.py --images 2000 --image-size 2160x3840 --labels 5-50 --latency 0.05
+
+Prints (and appends to --output as json line) images/sec, time of every stage and peak RSS,
+so results can be compared between versions
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import report
+from synthetic import generate_project
+
+
+def _last_instrumentation(api):
+    # stage times are collected by the pipeline itself (see src/instrumentation.py) and pushed to data
+    for field, data, append in reversed(api.pushed):
+        if data.get("instrumentation") is not None:
+            return data["instrumentation"]
+    return None
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on linux
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(self_rss / 1024, 1), round(children_rss / 1024, 1)
+
+
+def _version():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _size(value):
+    height, width = value.lower().split('x')
+    return int(height), int(width)
+
+
+def _range(value):
+    if '-' in value:
+        low, high = value.split('-')
+        return int(low), int(high)
+    return int(value), int(value)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Stats pipeline benchmark on a synthetic project")
+    parser.add_argument("--datasets", type=int, default=2)
+    parser.add_argument("--images", type=int, default=200)
+    parser.add_argument("--image-size", type=_size, default=(1080, 1920), help="HxW")
+    parser.add_argument("--labels", type=_range, default=(0, 20), help="labels per image: N or MIN-MAX")
+    parser.add_argument("--classes", type=int, default=10)
+    parser.add_argument("--tags", type=int, default=3)
+    parser.add_argument("--mix", default="rectangle:0.5,polygon:0.4,bitmap:0.1", help="geometry mix")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per api call")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--state", default="{}", help="json with app state overrides")
+    parser.add_argument("--output", default=None, help="append results as json line to this file")
+    return parser.parse_args(argv)
+
+
+def run(args):
+    generation_start = time.perf_counter()
+    api = generate_project(datasets_count=args.datasets, images_count=args.images, image_size=args.image_size,
+                           labels_count=args.labels, classes_count=args.classes, tags_count=args.tags,
+                           geometry_mix=args.mix, latency=args.latency, seed=args.seed)
+    generation_time = time.perf_counter() - generation_start
+
+    state = {"useCache": False, "chartsRefreshSec": None, "instrumentation": True}
+    state.update(json.loads(args.state))
+
+    start = time.perf_counter()
+    report.calculate_stats(api, task_id=0, project_id=api.project_info.id, state=state)
+    total_time = time.perf_counter() - start
+
+    self_rss, children_rss = _peak_rss_mb()
+    return {
+        "version": _version(),
+        "params": {k: v for k, v in vars(args).items() if k != "output"},
+        "state": state,
+        "generation_sec": round(generation_time, 3),
+        "total_sec": round(total_time, 3),
+        "images_per_sec": round(args.images / total_time, 2) if total_time > 0 else None,
+        "instrumentation": _last_instrumentation(api),
+        "set_data_calls": len(api.pushed),
+        "peak_rss_mb": self_rss,
+        "peak_rss_children_mb": children_rss,
+    }
+
+
+def main():
+    args = parse_args()
+    result = run(args)
+    print(json.dumps(result, indent=4))
+    if args.output is not None:
+        with open(args.output, "a") as f:
+            f.write(json.dumps(result) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Runs the report script (src/py_script.py) on a synthetic project with the in-process FakeApi and prints
+its time and peak RSS. Template parameters (%%NAME:default%%) get their defaults, other versions of the
+script can be measured with --script, e.g. the one before the columnar table:
+
+    git show cb905ff~1:src/py_script.py > /tmp/py_script_old.py
+    python benchmark/run_report_script.py --images 5000 --script /tmp/py_script_old.py
+    python benchmark/run_report_script.py --images 5000
+
+Every run should be a separate process, peak RSS is the maximum of the whole process
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC_DIR)
+
+import supervisely_lib as sly
+
+from run_benchmark import _peak_rss_mb, _range, _size, _version
+from synthetic import generate_project
+
+_TEMPLATE_DEFAULT = re.compile(r"%%[A-Z_]+:([^%]*)%%")
+
+
+def _script_source(path, api):
+    with open(path) as f:
+        source = f.read()
+    source = source.replace("%%WORKSPACE_ID%%", str(api.project_info.workspace_id))
+    source = source.replace("%%IN_VIDEO_PROJECT_NAME%%", api.project_info.name)
+    return _TEMPLATE_DEFAULT.sub(lambda match: match.group(1), source)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Report script time and peak RSS on a synthetic project")
+    parser.add_argument("--script", default=os.path.join(SRC_DIR, "py_script.py"))
+    parser.add_argument("--datasets", type=int, default=2)
+    parser.add_argument("--images", type=int, default=1000)
+    parser.add_argument("--image-size", type=_size, default=(480, 640), help="HxW")
+    parser.add_argument("--labels", type=_range, default=(0, 20), help="labels per image: N or MIN-MAX")
+    parser.add_argument("--classes", type=int, default=20)
+    parser.add_argument("--tags", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="jsonl file to append results to")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    api = generate_project(datasets_count=args.datasets, images_count=args.images, image_size=args.image_size,
+                           labels_count=args.labels, classes_count=args.classes, tags_count=args.tags,
+                           seed=args.seed)
+    rss_before, _ = _peak_rss_mb()
+    # the script creates its api with sly.Api.from_env()
+    sly.Api.from_env = staticmethod(lambda *_args, **_kwargs: api)
+
+    source = _script_source(args.script, api)
+    start = time.perf_counter()
+    try:
+        exec(compile(source, args.script, "exec"), {"__name__": "__main__"})
+    except SystemExit:
+        pass
+    elapsed = time.perf_counter() - start
+    rss_after, _ = _peak_rss_mb()
+
+    result = {
+        "version": _version(),
+        "script": os.path.abspath(args.script),
+        "images": args.images,
+        "classes": args.classes,
+        "tags": args.tags,
+        "seconds": round(elapsed, 3),
+        # peak of the process: synthetic project + script, and of the synthetic project only
+        "peak_rss_mb": rss_after,
+        "project_rss_mb": rss_before,
+        "widgets": len(api.reports[-1][1]) if len(api.reports) != 0 else 0,
+    }
+    print(json.dumps(result, indent=4))
+    if args.output:
+        with open(args.output, "a") as f:
+            f.write(json.dumps(result) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Local check of the sharded calculation: K processes calculate their shards of the same synthetic project
+with FakeApi, the coordinator merges partial results (report.merge_shards) and the merged charts are
+compared with the charts of the unsharded calculation:
+
+    python benchmark/run_shards.py --shards 4 --images 1000 --shard-by hash
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import report
+from run_benchmark import _range, _size
+from synthetic import generate_project
+
+# charts that must be the same for the merged and the unsharded calculations
+COMPARED_CHARTS = ["classAreaDistr", "classOnImageCount", "tagOnImageCount"]
+
+
+def _project(args):
+    # every process generates the same project (same seed)
+    return generate_project(datasets_count=args.datasets, images_count=args.images, image_size=args.image_size,
+                            labels_count=args.labels, classes_count=args.classes, tags_count=args.tags,
+                            latency=args.latency, seed=args.seed)
+
+
+def _run_shard(args, state, shard_index):
+    api = _project(args)
+    report.calculate_stats(api, task_id=0, project_id=api.project_info.id, state={**state, "shardIndex": shard_index})
+
+
+def _last_chart(api, key):
+    for _, data, _ in reversed(api.pushed):
+        if data.get(key) is not None:
+            return [trace.get("y", []) for trace in data[key].get("data", [])]
+    return None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Sharded calculation check on a synthetic project")
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--shard-by", default="hash", choices=["hash", "dataset"])
+    parser.add_argument("--datasets", type=int, default=4)
+    parser.add_argument("--images", type=int, default=400)
+    parser.add_argument("--image-size", type=_size, default=(480, 640), help="HxW")
+    parser.add_argument("--labels", type=_range, default=(0, 10), help="labels per image: N or MIN-MAX")
+    parser.add_argument("--classes", type=int, default=5)
+    parser.add_argument("--tags", type=int, default=2)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per api call")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    shards_dir = tempfile.mkdtemp(prefix="project_stats_shards_")
+    state = {"useCache": False, "checkpointSec": None, "quickReport": False, "chartsRefreshSec": None,
+             "instrumentation": False, "shardCount": args.shards, "shardBy": args.shard_by,
+             "shardDir": shards_dir, "shardTableRows": True}
+
+    start = time.perf_counter()
+    processes = [multiprocessing.Process(target=_run_shard, args=(args, state, idx)) for idx in range(args.shards)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    if any(process.exitcode != 0 for process in processes):
+        raise RuntimeError("Some shards failed")
+    shards_time = time.perf_counter() - start
+
+    merged_api = _project(args)
+    start = time.perf_counter()
+    aggregator = report.merge_shards(merged_api, 0, merged_api.project_info.id, state)
+    merge_time = time.perf_counter() - start
+
+    reference_api = _project(args)
+    start = time.perf_counter()
+    report.calculate_stats(reference_api, 0, reference_api.project_info.id, {**state, "shardCount": 1})
+    reference_time = time.perf_counter() - start
+
+    same = {}
+    for key in COMPARED_CHARTS:
+        merged, reference = _last_chart(merged_api, key), _last_chart(reference_api, key)
+        same[key] = merged is not None and reference is not None and len(merged) == len(reference) and \
+            all(np.allclose(m, r) for m, r in zip(merged, reference))
+
+    print(json.dumps({
+        "shards": args.shards,
+        "shard_by": args.shard_by,
+        "images": aggregator.images_count,
+        "shards_sec": round(shards_time, 3),
+        "merge_sec": round(merge_time, 3),
+        "unsharded_sec": round(reference_time, 3),
+        "same_charts": same,
+    }, indent=4))
+    if not all(same.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
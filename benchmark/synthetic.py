@@ -0,0 +1,107 @@
+"""
+Synthetic images projects for benchmarks: ProjectMeta + annotations json with configurable image sizes,
+number of labels, geometry mix and number of classes/tags
+"""
+import random
+
+import numpy as np
+import supervisely_lib as sly
+
+from fake_api import DatasetInfo, FakeApi, ImageInfo, ProjectInfo
+
+GEOMETRIES = {
+    "rectangle": sly.Rectangle,
+    "polygon": sly.Polygon,
+    "bitmap": sly.Bitmap,
+}
+
+
+def _parse_mix(geometry_mix):
+    """'rectangle:0.5,polygon:0.4,bitmap:0.1' -> {'rectangle': 0.5, ...}"""
+    if isinstance(geometry_mix, dict):
+        return geometry_mix
+    mix = {}
+    for item in geometry_mix.split(','):
+        name, weight = item.split(':')
+        if name not in GEOMETRIES:
+            raise ValueError("Unknown geometry {!r}, supported: {}".format(name, list(GEOMETRIES.keys())))
+        mix[name] = float(weight)
+    return mix
+
+
+def generate_meta(classes_count, tags_count, geometry_mix):
+    mix = _parse_mix(geometry_mix)
+    shapes = list(mix.keys())
+    obj_classes = [sly.ObjClass("class_{}".format(idx), GEOMETRIES[shapes[idx % len(shapes)]],
+                                color=sly.color.random_rgb())
+                   for idx in range(classes_count)]
+    tag_metas = [sly.TagMeta("tag_{}".format(idx), sly.TagValueType.NONE) for idx in range(tags_count)]
+    return sly.ProjectMeta(obj_classes=sly.ObjClassCollection(obj_classes),
+                           tag_metas=sly.TagMetaCollection(tag_metas))
+
+
+def _random_geometry(shape, height, width, rnd):
+    box_h = rnd.randint(1, max(height // 4, 1))
+    box_w = rnd.randint(1, max(width // 4, 1))
+    top = rnd.randint(0, height - box_h)
+    left = rnd.randint(0, width - box_w)
+    if shape == "rectangle":
+        return sly.Rectangle(top, left, top + box_h - 1, left + box_w - 1)
+    if shape == "polygon":
+        # star-like polygon inside the box
+        points_count = rnd.randint(3, 12)
+        angles = sorted(rnd.uniform(0, 2 * np.pi) for _ in range(points_count))
+        exterior = [sly.PointLocation(int(top + box_h / 2 * (1 + rnd.uniform(0.3, 1) * np.sin(a))),
+                                      int(left + box_w / 2 * (1 + rnd.uniform(0.3, 1) * np.cos(a))))
+                    for a in angles]
+        return sly.Polygon(exterior, interior=[])
+    data = np.random.RandomState(rnd.randint(0, 2 ** 31 - 1)).rand(box_h, box_w) > 0.5
+    data[0, 0] = True  # bitmap can't be empty
+    return sly.Bitmap(data, origin=sly.PointLocation(top, left))
+
+
+def generate_annotation(meta, height, width, labels_count, geometry_mix, rnd, tags_probability=0.3):
+    mix = _parse_mix(geometry_mix)
+    shapes = list(mix.keys())
+    classes_by_shape = {shape: [obj_class for obj_class in meta.obj_classes
+                                if obj_class.geometry_type is GEOMETRIES[shape]] for shape in shapes}
+    shapes = [shape for shape in shapes if len(classes_by_shape[shape]) != 0]
+    weights = [mix[shape] for shape in shapes]
+
+    labels = []
+    for _ in range(labels_count):
+        shape = rnd.choices(shapes, weights=weights)[0]
+        obj_class = rnd.choice(classes_by_shape[shape])
+        labels.append(sly.Label(_random_geometry(shape, height, width, rnd), obj_class))
+    img_tags = [sly.Tag(tag_meta) for tag_meta in meta.tag_metas if rnd.random() < tags_probability]
+    return sly.Annotation((height, width), labels=labels, img_tags=sly.TagCollection(img_tags))
+
+
+def generate_project(datasets_count=2, images_count=100, image_size=(1080, 1920), labels_count=(0, 20),
+                     classes_count=10, tags_count=3, geometry_mix="rectangle:0.5,polygon:0.4,bitmap:0.1",
+                     latency=0.0, seed=0):
+    """
+    Returns FakeApi with one project of `images_count` images split between datasets.
+    labels_count: (min, max) number of labels per image
+    """
+    rnd = random.Random(seed)
+    meta = generate_meta(classes_count, tags_count, geometry_mix)
+    project = ProjectInfo(id=1, name="synthetic", type=str(sly.ProjectType.IMAGES), workspace_id=1,
+                          images_count=images_count)
+    datasets = {}
+    image_id = 1
+    for ds_idx in range(datasets_count):
+        ds_images_count = images_count // datasets_count + (1 if ds_idx < images_count % datasets_count else 0)
+        dataset = DatasetInfo(id=ds_idx + 1, name="ds_{}".format(ds_idx), project_id=project.id,
+                              images_count=ds_images_count)
+        items = []
+        for _ in range(ds_images_count):
+            height, width = image_size
+            ann = generate_annotation(meta, height, width, rnd.randint(*labels_count), geometry_mix, rnd)
+            info = ImageInfo(id=image_id, name="image_{:08d}.jpg".format(image_id), dataset_id=dataset.id,
+                             height=height, width=width, labels_count=len(ann.labels),
+                             updated_at="2020-01-01T00:00:00.000Z")
+            items.append((info, ann.to_json()))
+            image_id += 1
+        datasets[dataset] = items
+    return FakeApi(project, meta.to_json(), datasets, latency=latency)
@@ -0,0 +1,184 @@
+from collections import Counter
+
+import numpy as np
+
+from sketch import QuantileSketch
+from table import DECIMALS
+
+# positions of values in ImageStats rows
+HEIGHT, WIDTH, CHANNELS, UNLABELED_AREA, TOTAL_COUNT = range(5)
+CLASSES_OFFSET = 5
+
+# fixed log-scale bins of per-object histograms: area in % of the image and bbox size (sqrt of bbox area) in pixels,
+# values out of range fall into the first / last bin
+OBJECT_AREA_BINS = np.logspace(-4, 2, 25)
+OBJECT_SIZE_BINS = np.logspace(0, 4, 25)
+
+# fields of the state (see to_dict), arrays are summed by merge
+_ARRAY_FIELDS = ["area_sum", "area_nonzero", "count_sum", "count_nonzero", "tag_nonzero",
+                 "cooccurrence", "object_area_hist", "object_size_hist"]
+
+# per-class quantile sketches: non-zero area % and objects count per image, size of every object
+SKETCH_FIELDS = ["area", "count", "size"]
+SKETCH_QUANTILES = [0.5, 0.9, 0.99]
+
+
+def _bin_indices(values, bins):
+    return np.clip(np.searchsorted(bins, values, side='right') - 1, 0, len(bins) - 2)
+
+
+class StatsAggregator:
+    """
+    Running sums / non-zero counters of ImageStats rows for the summary charts, class co-occurrence matrix
+    (number of images with both classes) and per-object histograms of every class, memory usage is
+    O(classes^2 + classes * (bins + sketch size) + tags + distinct resolutions) and doesn't depend on the number
+    of images. Percentiles of area, count and object size are estimated by QuantileSketch of every class.
+    Values are rounded the same way as in the per-image table, so "non-zero" means the same in both
+    """
+
+    def __init__(self, class_names, tag_names, sketch_k=200):
+        self.class_names = list(class_names)
+        self.tag_names = list(tag_names)
+        classes_count = len(self.class_names)
+
+        # 0 - unlabeled area, 1.. - classes
+        self._area_cols = np.array([UNLABELED_AREA, *range(CLASSES_OFFSET, CLASSES_OFFSET + 2 * classes_count, 2)])
+        self._count_cols = np.arange(CLASSES_OFFSET + 1, CLASSES_OFFSET + 2 * classes_count, 2)
+        # 0 - any tag, 1.. - tags
+        tags_offset = CLASSES_OFFSET + 2 * classes_count
+        self._tag_cols = np.arange(tags_offset, tags_offset + len(self.tag_names) + 1) \
+            if len(self.tag_names) != 0 else np.arange(0)
+
+        self.images_count = 0
+        self.area_sum = np.zeros(len(self._area_cols), dtype=np.float64)
+        self.area_nonzero = np.zeros(len(self._area_cols), dtype=np.int64)
+        self.count_sum = np.zeros(len(self._count_cols), dtype=np.float64)
+        self.count_nonzero = np.zeros(len(self._count_cols), dtype=np.int64)
+        self.tag_nonzero = np.zeros(len(self._tag_cols), dtype=np.int64)
+        self.resolutions = Counter()
+        self.cooccurrence = np.zeros((classes_count, classes_count), dtype=np.int64)
+        self.object_area_hist = np.zeros((classes_count, len(OBJECT_AREA_BINS) - 1), dtype=np.int64)
+        self.object_size_hist = np.zeros((classes_count, len(OBJECT_SIZE_BINS) - 1), dtype=np.int64)
+        self.sketch_k = sketch_k
+        self.sketches = {field: [QuantileSketch(sketch_k) for _ in self.class_names] for field in SKETCH_FIELDS}
+
+    def add_objects(self, objects):
+        """objects - per-object values of ImageStats.calc: [[class index, area %, bbox size], ...]"""
+        if len(objects) == 0:
+            return
+        values = np.asarray(objects, dtype=np.float64)
+        class_idx = values[:, 0].astype(np.int64)
+        np.add.at(self.object_area_hist, (class_idx, _bin_indices(values[:, 1], OBJECT_AREA_BINS)), 1)
+        np.add.at(self.object_size_hist, (class_idx, _bin_indices(values[:, 2], OBJECT_SIZE_BINS)), 1)
+        for idx in np.unique(class_idx).tolist():
+            self.sketches["size"][idx].update(values[class_idx == idx, 2])
+
+    def add(self, rows):
+        if len(rows) == 0:
+            return
+        values = np.round(np.asarray(rows, dtype=np.float64), DECIMALS)
+        self.images_count += len(values)
+
+        areas = values[:, self._area_cols]
+        self.area_sum += areas.sum(axis=0)
+        self.area_nonzero += np.count_nonzero(areas, axis=0)
+
+        counts = values[:, self._count_cols]
+        self.count_sum += counts.sum(axis=0)
+        self.count_nonzero += np.count_nonzero(counts, axis=0)
+        # only classes present in the batch (bounded by the number of labels), float32 product goes through BLAS
+        # and is exact for counts up to 2^24
+        present = counts > 0
+        present_cols = np.flatnonzero(present.any(axis=0))
+        if len(present_cols) != 0:
+            present = present[:, present_cols].astype(np.float32)
+            self.cooccurrence[np.ix_(present_cols, present_cols)] += np.rint(present.T @ present).astype(np.int64)
+
+        # only images with the class, as in the averages (column 0 of areas is unlabeled area)
+        for idx in range(len(self.class_names)):
+            self.sketches["area"][idx].update(areas[counts[:, idx] > 0, idx + 1])
+            self.sketches["count"][idx].update(counts[counts[:, idx] > 0, idx])
+
+        self.tag_nonzero += np.count_nonzero(values[:, self._tag_cols] > 0, axis=0)
+
+        resolutions, resolutions_counts = np.unique(values[:, [HEIGHT, WIDTH, CHANNELS]].astype(np.int64),
+                                                    axis=0, return_counts=True)
+        for resolution, count in zip(resolutions.tolist(), resolutions_counts.tolist()):
+            self.resolutions["{} x {} x {}".format(*resolution)] += count
+
+    def to_dict(self):
+        """json-serializable state, StatsAggregator.from_dict(agg.to_dict()) restores it"""
+        return {
+            "class_names": self.class_names,
+            "tag_names": self.tag_names,
+            "images_count": self.images_count,
+            **{field: getattr(self, field).tolist() for field in _ARRAY_FIELDS},
+            "resolutions": dict(self.resolutions),
+            **self.sketches_to_dict(),
+        }
+
+    def sketches_to_dict(self):
+        """json-serializable quantile sketches, load_sketches() restores them in an aggregator of the same classes"""
+        return {
+            "class_names": self.class_names,
+            "sketch_k": self.sketch_k,
+            "sketches": {field: [sketch.to_dict() for sketch in sketches]
+                         for field, sketches in self.sketches.items()},
+        }
+
+    def load_sketches(self, data):
+        if data["class_names"] != self.class_names or data["sketch_k"] != self.sketch_k:
+            raise ValueError("Sketches of different classes or k can't be loaded")
+        for field, sketches in data["sketches"].items():
+            self.sketches[field] = [QuantileSketch.from_dict(sketch) for sketch in sketches]
+
+    @classmethod
+    def from_dict(cls, data):
+        aggregator = cls(data["class_names"], data["tag_names"], sketch_k=data.get("sketch_k", 200))
+        aggregator.images_count = data["images_count"]
+        for field in _ARRAY_FIELDS:
+            if field not in data:
+                # state saved by the previous versions
+                continue
+            current = getattr(aggregator, field)
+            setattr(aggregator, field, np.array(data[field], dtype=current.dtype).reshape(current.shape))
+        aggregator.resolutions = Counter(data["resolutions"])
+        if "sketches" in data:
+            aggregator.load_sketches(data)
+        return aggregator
+
+    def merge(self, other):
+        """adds stats of another aggregator (e.g. of another shard) of the same classes and tags"""
+        if other.class_names != self.class_names or other.tag_names != self.tag_names:
+            raise ValueError("Aggregators of different classes/tags can't be merged")
+        self.images_count += other.images_count
+        for field in _ARRAY_FIELDS:
+            getattr(self, field).__iadd__(getattr(other, field))
+        self.resolutions.update(other.resolutions)
+        for field in SKETCH_FIELDS:
+            for sketch, other_sketch in zip(self.sketches[field], other.sketches[field]):
+                sketch.merge(other_sketch)
+        return self
+
+    def area_mean_nonzero(self):
+        """average area % of unlabeled area and every class across images which have it"""
+        return _safe_mean(self.area_sum, self.area_nonzero)
+
+    def count_mean_nonzero(self):
+        """average number of objects of every class across images which have this class"""
+        return _safe_mean(self.count_sum, self.count_nonzero)
+
+    def quantiles(self, field, qs=SKETCH_QUANTILES):
+        """classes x len(qs) array of estimated quantiles of SKETCH_FIELDS field, nan for classes without values"""
+        return np.array([sketch.quantiles(qs) for sketch in self.sketches[field]]).reshape(-1, len(qs))
+
+    def images_with_class(self):
+        return self.count_nonzero
+
+    def images_with_tag(self):
+        """0 - any tag, 1.. - tags"""
+        return self.tag_nonzero
+
+
+def _safe_mean(sums, counts):
+    return np.divide(sums, counts, out=np.zeros(len(sums), dtype=np.float64), where=counts != 0)
@@ -0,0 +1,351 @@
+from collections import OrderedDict, defaultdict
+
+import numpy as np
+from shapely.affinity import translate
+from shapely.geometry import MultiPoint, Polygon as ShapelyPolygon, box
+from shapely.ops import unary_union
+from shapely.validation import make_valid
+
+import supervisely_lib as sly
+
+from instrumentation import Instrumentation
+
+# instrumentation counters of MaskPool
+MASK_POOL_HITS_COUNTER = "mask pool hits"
+MASK_POOL_MISSES_COUNTER = "mask pool misses"
+
+# stat_area() was computed on the HxWx3 index render, so "channels" column always was 3
+RENDER_CHANNELS = 3
+
+# area backends (selected by state["areaBackend"])
+RASTER = "raster"
+ANALYTIC = "analytic"
+APPROXIMATE = "approximate"
+AREA_BACKENDS = [RASTER, ANALYTIC, APPROXIMATE]
+
+# extra field of approximate stats: estimated worst-case error of every area % value
+ERROR_FIELD = "area error %"
+
+
+# np.bincount casts input to intp, so big masks are counted by chunks to limit temporary memory
+BINCOUNT_CHUNK = 1 << 20
+
+
+def mask_dtype(classes_count):
+    # single-channel uint16 / int32 images are supported by cv2 drawing functions,
+    # index 0 is reserved for unlabeled area
+    return np.uint16 if classes_count < np.iinfo(np.uint16).max else np.int32
+
+
+def count_class_pixels(mask, classes_count):
+    """pixels count of every class index (0 - unlabeled) in one pass, cost doesn't depend on classes_count"""
+    counts = np.zeros(classes_count + 1, dtype=np.int64)
+    flat = mask.reshape(-1)
+    for start in range(0, flat.size, BINCOUNT_CHUNK):
+        counts += np.bincount(flat[start:start + BINCOUNT_CHUNK], minlength=classes_count + 1)
+    return counts
+
+
+class MaskPool:
+    """
+    Reusable class-index masks keyed by (shape, dtype), so images of the same size don't allocate and zero
+    a new mask every time. Masks are returned to the pool clean: only the touched bbox is zeroed on release.
+    At most max_bytes of free masks are kept, masks of the least recently used shapes are dropped first.
+    Not thread-safe: one pool per worker (see ImageStats). Hits and misses are counted in instrumentation
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, instrumentation: Instrumentation = None):
+        self.max_bytes = max_bytes
+        self.instrumentation = sly.take_with_default(instrumentation, Instrumentation(enabled=False))
+        self._free = OrderedDict()  # (shape, dtype) -> [mask, ...]
+        self._bytes = 0
+
+    def acquire(self, shape, dtype):
+        key = (tuple(shape), np.dtype(dtype).str)
+        masks = self._free.get(key)
+        if masks:
+            self._free.move_to_end(key)
+            mask = masks.pop()
+            if len(masks) == 0:
+                del self._free[key]
+            self._bytes -= mask.nbytes
+            self.instrumentation.add_count(MASK_POOL_HITS_COUNTER)
+            return mask
+        self.instrumentation.add_count(MASK_POOL_MISSES_COUNTER)
+        return np.zeros(shape, dtype=dtype)
+
+    def release(self, mask, bbox=None):
+        """bbox - (top, left, bottom, right) of the pixels that were changed, None - whole mask"""
+        if mask.nbytes > self.max_bytes:
+            return
+        if bbox is None:
+            mask.fill(0)
+        else:
+            top, left, bottom, right = bbox
+            mask[top:bottom, left:right] = 0
+        key = (mask.shape, mask.dtype.str)
+        self._free.setdefault(key, []).append(mask)
+        self._free.move_to_end(key)
+        self._bytes += mask.nbytes
+        while self._bytes > self.max_bytes:
+            oldest_key, masks = next(iter(self._free.items()))
+            self._bytes -= masks.pop(0).nbytes
+            if len(masks) == 0:
+                del self._free[oldest_key]
+
+
+# geometries that are drawn strictly inside their bbox
+_BBOX_BOUNDED = (sly.Rectangle, sly.Polygon, sly.Bitmap)
+
+
+def _touched_bbox(geometries, height, width):
+    """(top, left, bottom, right) (exclusive) that contains every drawn pixel, None - unknown (whole image)"""
+    top, left, bottom, right = height, width, 0, 0
+    for geometry in geometries:
+        if not isinstance(geometry, _BBOX_BOUNDED):
+            return None
+        bbox = geometry.to_bbox()
+        top, left = min(top, bbox.top), min(left, bbox.left)
+        bottom, right = max(bottom, bbox.bottom + 1), max(right, bbox.right + 1)
+    top, left, bottom, right = max(top, 0), max(left, 0), min(bottom, height), min(right, width)
+    if top >= bottom or left >= right:
+        return 0, 0, 0, 0
+    return top, left, bottom, right
+
+
+def _count_in_bbox(mask, bbox, classes_count):
+    # pixels outside of the touched bbox are unlabeled, only bbox is scanned
+    if bbox is None:
+        return count_class_pixels(mask, classes_count)
+    top, left, bottom, right = bbox
+    counts = count_class_pixels(mask[top:bottom, left:right], classes_count)
+    counts[0] += mask.shape[0] * mask.shape[1] - (bottom - top) * (right - left)
+    return counts
+
+
+def draw_class_idx_mask(ann, name_to_index, mask=None):
+    # single-channel analog of ann.draw_class_idx_rgb: labels are drawn in the same order,
+    # so later labels overwrite earlier ones exactly as on the RGB index render
+    if mask is None:
+        mask = np.zeros(ann.img_size, dtype=mask_dtype(len(name_to_index)))
+    for label in ann.labels:
+        label.geometry.draw(mask, name_to_index[label.obj_class.name])
+    return mask
+
+
+# max side of the approximate mask when neither scale nor max_side is given
+DEFAULT_APPROX_MAX_SIDE = 1024
+
+
+def get_approx_size(img_size, scale=None, max_side=None):
+    """explicit scale has priority over max_side"""
+    height, width = img_size
+    if scale is None:
+        max_side = sly.take_with_default(max_side, DEFAULT_APPROX_MAX_SIDE)
+        scale = min(1.0, max_side / max(height, width))
+    return max(int(round(height * scale)), 1), max(int(round(width * scale)), 1)
+
+
+def _boundary_length(geometry):
+    # length of the label border in pixels of the original image
+    if isinstance(geometry, (sly.Rectangle, sly.Polygon)):
+        return _to_shapely(geometry).length
+    if isinstance(geometry, sly.Bitmap):
+        data = geometry.data
+        return np.count_nonzero(np.diff(data, axis=0)) + np.count_nonzero(np.diff(data, axis=1)) + \
+               np.count_nonzero(data[[0, -1], :]) + np.count_nonzero(data[:, [0, -1]])
+    bbox = geometry.to_bbox()
+    return 2 * (bbox.height + bbox.width)
+
+
+def _approx_class_areas(ann, name_to_index, scale=None, max_side=None, pool: MaskPool = None):
+    # labels are drawn on a downscaled mask; only pixels crossed by label borders can be
+    # assigned to a wrong class, so their total count bounds the error of every area value
+    height, width = ann.img_size
+    out_size = get_approx_size(ann.img_size, scale, max_side)
+    dtype = mask_dtype(len(name_to_index))
+    mask = pool.acquire(out_size, dtype) if pool is not None else np.zeros(out_size, dtype=dtype)
+    coeff = out_size[0] / height
+    border_pixels = 0
+    resized = []
+    for label in ann.labels:
+        geometry = label.geometry.resize(ann.img_size, out_size)
+        geometry.draw(mask, name_to_index[label.obj_class.name])
+        resized.append(geometry)
+        border_pixels += _boundary_length(label.geometry) * coeff + 4
+    bbox = _touched_bbox(resized, *out_size)
+    counts = _count_in_bbox(mask, bbox, len(name_to_index))
+    if pool is not None:
+        pool.release(mask, bbox)
+    pixel_area = (height * width) / (out_size[0] * out_size[1])
+    class_areas = {idx: cnt * pixel_area for idx, cnt in enumerate(counts.tolist()) if idx != 0}
+    error = min(border_pixels / (out_size[0] * out_size[1]) * 100.0, 100.0)
+    return class_areas, error
+
+
+def _raster_class_areas(ann, class_names, name_to_index, pool: MaskPool = None):
+    height, width = ann.img_size
+    if len(ann.labels) == 0:
+        return {}
+    bbox = _touched_bbox([label.geometry for label in ann.labels], height, width)
+    dtype = mask_dtype(len(name_to_index))
+    mask = pool.acquire(ann.img_size, dtype) if pool is not None else None
+    mask = draw_class_idx_mask(ann, name_to_index, mask)
+    counts = _count_in_bbox(mask, bbox, len(name_to_index))
+    if pool is not None:
+        pool.release(mask, bbox)
+    return {name_to_index[name]: int(counts[name_to_index[name]]) for name in class_names}
+
+
+def _bounds_intersect(a, b):
+    # (min_x, min_y, max_x, max_y), touching boxes do not share any area
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+# vertices of the diamond |dx| + |dy| <= 0.5 around the center of a pixel
+_PIXEL_DIAMOND = [(0.5, 0.0), (-0.5, 0.0), (0.0, 0.5), (0.0, -0.5)]
+
+
+def _ring_pixels(coords):
+    # Minkowski sum of the ring polygon and the diamond: translated copies of the polygon and of every edge,
+    # an edge covers max(|dx|, |dy|) boundary pixels like the scanline fill of the raster does
+    coords = [(x + 0.5, y + 0.5) for x, y in coords]
+    polygon = ShapelyPolygon(coords)
+    if not polygon.is_valid:
+        # all lobes of a self-intersecting ring are filled on the raster, buffer(0) would drop some of them
+        polygon = make_valid(polygon)
+    parts = [translate(polygon, dx, dy) for dx, dy in _PIXEL_DIAMOND]
+    for (x0, y0), (x1, y1) in zip(coords, coords[1:] + coords[:1]):
+        parts.append(MultiPoint([(x + dx, y + dy) for x, y in [(x0, y0), (x1, y1)]
+                                 for dx, dy in _PIXEL_DIAMOND]).convex_hull)
+    return unary_union(parts)
+
+
+def _to_shapely(geometry):
+    # region covered by the raster pixels, pixel (row, col) is the unit square [col, col + 1] x [row, row + 1];
+    # polygon vertices are pixel centers, holes are erased with their boundary pixels as by sly.Polygon.draw
+    if isinstance(geometry, sly.Rectangle):
+        return box(geometry.left, geometry.top, geometry.right + 1, geometry.bottom + 1)
+    shape = _ring_pixels([(point.col, point.row) for point in geometry.exterior])
+    for interior in geometry.interior:
+        shape = shape.difference(_ring_pixels([(point.col, point.row) for point in interior]))
+    return shape
+
+
+def _clip_bitmap(geometry, height, width):
+    top, left = geometry.origin.row, geometry.origin.col
+    data = geometry.data
+    r0, c0 = max(top, 0), max(left, 0)
+    r1, c1 = min(top + data.shape[0], height), min(left + data.shape[1], width)
+    if r0 >= r1 or c0 >= c1:
+        return None
+    return (c0, r0, c1, r1), data[r0 - top:r1 - top, c0 - left:c1 - left]
+
+
+def _vector_class_areas(vectors, height, width, areas):
+    # area of the visible pixels region (w * h for rectangles, approximate for polygons): every label
+    # is clipped by the labels drawn over it, i.e. by the labels that follow it in the annotation
+    image_shape = box(0, 0, width, height)
+    drawn = []
+    for class_idx, geometry in reversed(vectors):
+        shape = _to_shapely(geometry).intersection(image_shape)
+        if shape.is_empty:
+            continue
+        bounds = shape.bounds
+        occluders = [occluder for occluder_bounds, occluder in drawn if _bounds_intersect(bounds, occluder_bounds)]
+        visible = shape.difference(unary_union(occluders)) if len(occluders) != 0 else shape
+        areas[class_idx] += visible.area
+        drawn.append((bounds, shape))
+
+
+def _bitmap_class_areas(bitmaps, areas):
+    # popcount of the visible pixels, overlaps are resolved only inside intersections of bboxes
+    for i, (class_idx, (bbox, data)) in enumerate(bitmaps):
+        visible = data
+        for _, (occluder_bbox, occluder_data) in bitmaps[i + 1:]:
+            if not _bounds_intersect(bbox, occluder_bbox):
+                continue
+            if visible is data:
+                visible = data.copy()
+            c0, r0 = max(bbox[0], occluder_bbox[0]), max(bbox[1], occluder_bbox[1])
+            c1, r1 = min(bbox[2], occluder_bbox[2]), min(bbox[3], occluder_bbox[3])
+            occluder_part = occluder_data[r0 - occluder_bbox[1]:r1 - occluder_bbox[1],
+                                          c0 - occluder_bbox[0]:c1 - occluder_bbox[0]]
+            visible[r0 - bbox[1]:r1 - bbox[1], c0 - bbox[0]:c1 - bbox[0]] &= ~occluder_part
+        areas[class_idx] += int(np.count_nonzero(visible))
+
+
+def _analytic_class_areas(ann, name_to_index):
+    # returns None if annotation has to be rasterized: unsupported geometry types
+    # or bitmaps overlapped with vector labels
+    height, width = ann.img_size
+    vectors = []
+    bitmaps = []
+    for label in ann.labels:
+        class_idx = name_to_index[label.obj_class.name]
+        geometry = label.geometry
+        if isinstance(geometry, (sly.Rectangle, sly.Polygon)):
+            vectors.append((class_idx, geometry))
+        elif isinstance(geometry, sly.Bitmap):
+            clipped = _clip_bitmap(geometry, height, width)
+            if clipped is not None:
+                bitmaps.append((class_idx, clipped))
+        else:
+            return None
+
+    if len(vectors) != 0 and len(bitmaps) != 0:
+        for _, geometry in vectors:
+            bbox = geometry.to_bbox()
+            bounds = (bbox.left, bbox.top, bbox.right + 1, bbox.bottom + 1)
+            for _, (bitmap_bbox, _) in bitmaps:
+                if _bounds_intersect(bounds, bitmap_bbox):
+                    return None
+
+    areas = defaultdict(int)
+    _vector_class_areas(vectors, height, width, areas)
+    _bitmap_class_areas(bitmaps, areas)
+    return areas
+
+
+def _format_area_stats(class_areas, class_names, name_to_index, height, width, percent):
+    # same fields as sly.Annotation.stat_area for the index render
+    total_pixels = height * width
+    result = {name: class_areas.get(name_to_index[name], 0) for name in class_names}
+    unlabeled_pixels = total_pixels - sum(result.values())
+
+    if percent is True:
+        for name in class_names:
+            result[name] = result[name] / total_pixels * 100.0
+        result['unlabeled area %'] = unlabeled_pixels / total_pixels * 100.0
+    else:
+        result['unlabeled area'] = unlabeled_pixels
+        result['total area'] = total_pixels
+
+    result['height'] = height
+    result['width'] = width
+    result['channels'] = RENDER_CHANNELS
+    return result
+
+
+def stat_area(ann, class_names, name_to_index, percent=False, backend=RASTER, scale=None, max_side=None,
+              pool: MaskPool = None):
+    """pool - masks of raster/approximate backends are taken from it instead of allocating new ones"""
+    if backend not in AREA_BACKENDS:
+        raise ValueError("Unknown area backend {!r}, supported: {}".format(backend, AREA_BACKENDS))
+
+    if backend == APPROXIMATE:
+        height, width = ann.img_size
+        class_areas, error = _approx_class_areas(ann, name_to_index, scale, max_side, pool)
+        result = _format_area_stats(class_areas, class_names, name_to_index, height, width, percent)
+        result[ERROR_FIELD] = error
+        return result
+
+    if backend == ANALYTIC:
+        class_areas = _analytic_class_areas(ann, name_to_index)
+        if class_areas is not None:
+            height, width = ann.img_size
+            return _format_area_stats(class_areas, class_names, name_to_index, height, width, percent)
+
+    height, width = ann.img_size
+    class_areas = _raster_class_areas(ann, class_names, name_to_index, pool)
+    return _format_area_stats(class_areas, class_names, name_to_index, height, width, percent)
@@ -0,0 +1,113 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+import supervisely_lib as sly
+
+CACHE_DIR = os.path.join(os.environ.get("SLY_APP_DATA_DIR", os.path.expanduser("~")), "project_stats_cache")
+
+
+def meta_fingerprint(meta: sly.ProjectMeta, **settings):
+    """rows depend on classes/tags (names, order, shapes) and on stats settings (area backend etc.)"""
+    data = {
+        "classes": [[obj_class.name, obj_class.geometry_type.geometry_name()] for obj_class in meta.obj_classes],
+        "tags": [tag_meta.name for tag_meta in meta.tag_metas],
+        "settings": settings
+    }
+    return hashlib.sha1(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def image_version(image_info):
+    # image is updated together with its annotation, labels_count is an additional guard
+    return "{}:{}".format(image_info.updated_at, image_info.labels_count)
+
+
+class StatsCache:
+    """
+    On-disk (SQLite) cache of ImageStats rows for incremental re-runs. Entry is valid only for the same
+    image version and the same meta fingerprint. Quantile sketches of the last complete run of the project
+    are kept as well (one entry per project, for its fingerprint). Safe to use from the prefetcher and the
+    main threads
+    """
+
+    def __init__(self, project_id, fingerprint, cache_dir=CACHE_DIR):
+        sly.fs.mkdir(cache_dir)
+        self.path = os.path.join(cache_dir, "stats_cache.db")
+        self.project_id = project_id
+        self.fingerprint = fingerprint
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        # v2: per-object values are stored together with the rows
+        self._conn.execute("CREATE TABLE IF NOT EXISTS rows_v2 ("
+                           "project_id INTEGER, image_id INTEGER, version TEXT, fingerprint TEXT, "
+                           "row TEXT, area_error REAL, objects TEXT, PRIMARY KEY (project_id, image_id))")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS sketches_v1 ("
+                           "project_id INTEGER PRIMARY KEY, fingerprint TEXT, sketches TEXT)")
+        self._conn.commit()
+
+    def get_many(self, image_infos):
+        """returns {image_id: (row, area_error, objects)} for up-to-date entries"""
+        versions = {info.id: image_version(info) for info in image_infos}
+        if len(versions) == 0:
+            return {}
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT image_id, version, row, area_error, objects FROM rows_v2 WHERE project_id = ? AND fingerprint = ? "
+                "AND image_id IN ({})".format(",".join("?" * len(versions))),
+                [self.project_id, self.fingerprint, *versions.keys()])
+            results = {image_id: (json.loads(row), area_error, json.loads(objects))
+                       for image_id, version, row, area_error, objects in cursor.fetchall()
+                       if versions[image_id] == version}
+            self.hits += len(results)
+            self.misses += len(versions) - len(results)
+        return results
+
+    def put_many(self, image_infos, results):
+        records = [(self.project_id, info.id, image_version(info), self.fingerprint,
+                    json.dumps(row, cls=sly._utils.NpEncoder), float(area_error),
+                    json.dumps(objects, cls=sly._utils.NpEncoder))
+                   for info, (row, area_error, objects) in zip(image_infos, results)]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO rows_v2 VALUES (?, ?, ?, ?, ?, ?, ?)", records)
+            self._conn.commit()
+
+    def evict_missing(self, existing_image_ids):
+        """removes entries of the images which were deleted from the project"""
+        existing_image_ids = set(existing_image_ids)
+        with self._lock:
+            cached_ids = [image_id for image_id, in
+                          self._conn.execute("SELECT image_id FROM rows_v2 WHERE project_id = ?", [self.project_id])]
+            deleted = [(self.project_id, image_id) for image_id in cached_ids if image_id not in existing_image_ids]
+            self._conn.executemany("DELETE FROM rows_v2 WHERE project_id = ? AND image_id = ?", deleted)
+            self._conn.commit()
+        return len(deleted)
+
+    def get_sketches(self):
+        """sketches saved by put_sketches for the same fingerprint or None"""
+        with self._lock:
+            row = self._conn.execute("SELECT sketches FROM sketches_v1 WHERE project_id = ? AND fingerprint = ?",
+                                     [self.project_id, self.fingerprint]).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def put_sketches(self, sketches):
+        """sketches - StatsAggregator.sketches_to_dict() of the complete run, replace the previous ones"""
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO sketches_v1 VALUES (?, ?, ?)",
+                               [self.project_id, self.fingerprint, json.dumps(sketches)])
+            self._conn.commit()
+
+    def log_stats(self):
+        total = self.hits + self.misses
+        sly.logger.info("stats cache: {} hits, {} misses".format(self.hits, self.misses), extra={
+            "cache_hits": self.hits,
+            "cache_misses": self.misses,
+            "cache_hit_rate": self.hits / total if total != 0 else 0
+        })
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,225 @@
+import json
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+
+from aggregator import OBJECT_AREA_BINS, OBJECT_SIZE_BINS, SKETCH_QUANTILES
+
+UNLABELED_COL_NAME = 'unlabeled area %'
+ANY_TAG_COL_NAME = 'any tag'
+
+# charts pushed on every refresh with per-class matrices/traces (co-occurrence, object histograms)
+# show at most this number of classes (the most frequent ones)
+TOP_CLASSES = 50
+
+# loaders of all charts, they are hidden when the calculation fails (see failure_payload)
+LOADING_FIELDS = ["loadingDatasetImagesDistr", "loadingClassAreaDistr", "loadingClassOnImageCount",
+                  "loadingClassQuantiles", "loadingClassCooccurrence", "loadingObjectAreaDistr",
+                  "loadingObjectSizeDistr", "loadingTagOnImageCount", "loadingImageResolutionDistr"]
+
+
+def _with_percent_text(values, total_images_count):
+    return ["{} ({:.2f} %)".format(value, value * 100 / total_images_count) for value in values]
+
+
+def class_area_payload(aggregator, approximate=False):
+    # average class area per image
+    x = [UNLABELED_COL_NAME, *aggregator.class_names]
+    class_area_nonzero = aggregator.area_mean_nonzero().tolist()
+    class_count_nonzero = [0, *aggregator.count_mean_nonzero().tolist()]  # unlabeled area has no count
+    fig = go.Figure(
+        data=[
+            go.Bar(name='Area % (approximate)' if approximate else 'Area %', x=x, y=class_area_nonzero, yaxis='y', offsetgroup=1),
+            go.Bar(name='Count', x=x, y=class_count_nonzero, yaxis='y2', offsetgroup=2)
+        ],
+        layout={
+            'yaxis': {'title': 'Area'},
+            'yaxis2': {'title': 'Count', 'overlaying': 'y', 'side': 'right'}
+        }
+    )
+    fig.update_layout(barmode='group')
+    return {
+        "classAreaDistr": json.loads(fig.to_json()),
+        "loadingClassAreaDistr": False
+    }
+
+
+def class_on_image_payload(aggregator, total_images_count):
+    # images count with/without classes
+    images_with_count = aggregator.images_with_class().tolist()
+    images_without_count = [aggregator.images_count - with_count for with_count in images_with_count]
+    fig_with_without_count = go.Figure(
+        data=[
+            go.Bar(name='# of images that have class', x=aggregator.class_names, y=images_with_count,
+                   text=_with_percent_text(images_with_count, total_images_count)),
+            go.Bar(name='# of images that do not have class', x=aggregator.class_names, y=images_without_count,
+                   text=_with_percent_text(images_without_count, total_images_count))
+        ],
+    )
+    fig_with_without_count.update_layout(barmode='stack')  # , legend_orientation="h")
+    return {
+        "classOnImageCount": json.loads(fig_with_without_count.to_json()),
+        "loadingClassOnImageCount": False
+    }
+
+
+def tag_on_image_payload(aggregator, total_images_count):
+    # images with without tags
+    x = [ANY_TAG_COL_NAME, *aggregator.tag_names]
+    images_with_tag_count = aggregator.images_with_tag().tolist()
+    images_without_tag_count = [total_images_count - with_tag for with_tag in images_with_tag_count]
+    fig_tag_with_without_count = go.Figure(
+        data=[
+            go.Bar(name='# of images that have tag', x=x, y=images_with_tag_count,
+                   text=_with_percent_text(images_with_tag_count, total_images_count)),
+            go.Bar(name='# of images that do not have tag', x=x, y=images_without_tag_count,
+                   text=_with_percent_text(images_without_tag_count, total_images_count))
+        ],
+    )
+    fig_tag_with_without_count.update_layout(barmode='stack')
+    return {
+        "tagOnImageCount": json.loads(fig_tag_with_without_count.to_json()),
+        "loadingTagOnImageCount": False
+    }
+
+
+def resolution_figure(resolutions):
+    # images resolution (piechart), resolutions: {"h x w x c": count}
+    labels, values = [], []
+    for resolution, count in resolutions.most_common():
+        labels.append(resolution)
+        values.append(count)
+
+    df_resolution = pd.DataFrame({'resolution': labels, 'count': values})
+    df_resolution['percent'] = df_resolution['count'] / df_resolution['count'].sum() * 100
+    df_resolution.loc[df_resolution.index > 10, 'resolution'] = 'other'
+
+    return px.pie(df_resolution, names='resolution', values='count')  # labels='text')
+
+
+def resolution_payload(resolutions):
+    return {
+        "imageResolutionDistr": json.loads(resolution_figure(resolutions).to_json()),
+        "loadingImageResolutionDistr": False
+    }
+
+
+def dataset_figure(info_stats):
+    # labeled / unlabeled images of every dataset (by labels_count of image infos)
+    names = [name for name, _, _ in info_stats.datasets]
+    labeled = [labeled for _, _, labeled in info_stats.datasets]
+    unlabeled = [images_count - labeled for _, images_count, labeled in info_stats.datasets]
+    fig = go.Figure(
+        data=[
+            go.Bar(name='# of labeled images', x=names, y=labeled),
+            go.Bar(name='# of unlabeled images', x=names, y=unlabeled)
+        ],
+    )
+    fig.update_layout(barmode='stack')
+    return fig
+
+
+def dataset_payload(info_stats):
+    return {
+        "datasetImagesDistr": json.loads(dataset_figure(info_stats).to_json()),
+        "loadingDatasetImagesDistr": False,
+        "imagesCount": info_stats.images_count,
+        "labeledImagesCount": info_stats.labeled_count
+    }
+
+
+def _top_classes(aggregator, max_classes):
+    """indices (in the original order) of max_classes classes present on the most images and chart title"""
+    classes_count = len(aggregator.class_names)
+    if classes_count <= max_classes:
+        return np.arange(classes_count), None
+    top = np.sort(np.argsort(-aggregator.count_nonzero, kind='stable')[:max_classes])
+    return top, "{} most frequent of {} classes".format(max_classes, classes_count)
+
+
+def cooccurrence_payload(aggregator, max_classes=TOP_CLASSES):
+    # number of images where both classes are present, diagonal - images with the class
+    top, title = _top_classes(aggregator, max_classes)
+    matrix = aggregator.cooccurrence[np.ix_(top, top)]
+    class_names = [aggregator.class_names[idx] for idx in top.tolist()]
+    fig = go.Figure(
+        data=[go.Heatmap(x=class_names, y=class_names, z=matrix.tolist(), colorscale='Blues',
+                         hovertemplate='%{y} & %{x}: %{z} images<extra></extra>')],
+    )
+    fig.update_layout(title=title, yaxis={'autorange': 'reversed'})
+    return {
+        "classCooccurrence": json.loads(fig.to_json()),
+        "loadingClassCooccurrence": False
+    }
+
+
+def _histogram_figure(class_names, hist, bins, x_title, title):
+    # bin centers on log scale (geometric mean of the edges)
+    centers = np.sqrt(bins[:-1] * bins[1:]).tolist()
+    fig = go.Figure(
+        data=[go.Scatter(name=name, x=centers, y=class_hist.tolist(), mode='lines+markers')
+              for name, class_hist in zip(class_names, hist)],
+        layout={
+            'title': title,
+            'xaxis': {'title': x_title, 'type': 'log'},
+            'yaxis': {'title': '# of objects'}
+        }
+    )
+    return json.loads(fig.to_json())
+
+
+def object_histograms_payload(aggregator, max_classes=TOP_CLASSES):
+    # distributions of object area and bbox size per class, one trace per class
+    top, title = _top_classes(aggregator, max_classes)
+    class_names = [aggregator.class_names[idx] for idx in top.tolist()]
+    return {
+        "objectAreaDistr": _histogram_figure(class_names, aggregator.object_area_hist[top],
+                                             OBJECT_AREA_BINS, 'Object area, % of image', title),
+        "loadingObjectAreaDistr": False,
+        "objectSizeDistr": _histogram_figure(class_names, aggregator.object_size_hist[top],
+                                             OBJECT_SIZE_BINS, 'Object size (sqrt of bbox area), px', title),
+        "loadingObjectSizeDistr": False
+    }
+
+
+def class_quantiles_payload(aggregator, previous=False):
+    # percentiles of every class (estimated by quantile sketches): area % and count on images with the class,
+    # object size (sqrt of bbox area) in pixels; previous - sketches of the previous complete run
+    header = ['class']
+    columns = [aggregator.class_names]
+    for field, title in [("area", "area %"), ("count", "count"), ("size", "object size, px")]:
+        values = aggregator.quantiles(field)
+        for q_idx, q in enumerate(SKETCH_QUANTILES):
+            header.append("{} p{}".format(title, int(round(q * 100))))
+            columns.append(["" if np.isnan(value) else round(float(value), 2) for value in values[:, q_idx]])
+    fig = go.Figure(data=[go.Table(header={'values': header}, cells={'values': columns})])
+    return {
+        "classQuantiles": json.loads(fig.to_json()),
+        "classQuantilesPrevious": previous,
+        "loadingClassQuantiles": False
+    }
+
+
+def overview_payloads(info_stats):
+    """charts from image infos only, they are shown before annotations are downloaded"""
+    return [dataset_payload(info_stats), resolution_payload(info_stats.resolutions)]
+
+
+def summary_payloads(aggregator, total_images_count, approximate=False, with_resolutions=True):
+    payloads = [class_area_payload(aggregator, approximate),
+                class_on_image_payload(aggregator, total_images_count),
+                class_quantiles_payload(aggregator),
+                cooccurrence_payload(aggregator),
+                object_histograms_payload(aggregator)]
+    if len(aggregator.tag_names) != 0:
+        payloads.append(tag_on_image_payload(aggregator, total_images_count))
+    if with_resolutions:
+        payloads.append(resolution_payload(aggregator.resolutions))
+    return payloads
+
+
+def failure_payload(error):
+    # charts that are not shown yet will never be, loaders are replaced by the error message
+    return {"error": str(error), "stopped": True, **{name: False for name in LOADING_FIELDS}}
@@ -0,0 +1,89 @@
+import os
+import pickle
+import time
+
+import supervisely_lib as sly
+
+CHECKPOINT_DIR = os.path.join(os.environ.get("SLY_APP_DATA_DIR", os.path.expanduser("~")),
+                              "project_stats_checkpoints")
+
+
+class Checkpoint:
+    """
+    On-disk snapshot of a running calculation, saved incrementally: ids of processed images and rows of the
+    per-image table are appended to a log (only the ones added since the previous save), small state
+    (aggregator etc.) is rewritten every time together with the log size it corresponds to.
+    State file is replaced atomically and the log is read only up to the size recorded in it, so a crash
+    during saving keeps the previous snapshot. Files are per project, they are used only for the same meta
+    fingerprint (see cache.meta_fingerprint), so a restarted task resumes with compatible rows
+    """
+
+    def __init__(self, project_id, fingerprint, checkpoint_dir=CHECKPOINT_DIR, interval_sec=60, suffix=""):
+        sly.fs.mkdir(checkpoint_dir)
+        self.path = os.path.join(checkpoint_dir, "project_{}{}.pkl".format(project_id, suffix))
+        self.log_path = os.path.join(checkpoint_dir, "project_{}{}.log".format(project_id, suffix))
+        self.fingerprint = fingerprint
+        self.interval_sec = interval_sec
+        self._saved_at = time.time()
+        self._log_size = None  # size of the valid part of the log, None - log of this run is not started
+
+    def _read_log(self, log_size):
+        records = []
+        with open(self.log_path, "rb") as f:
+            while f.tell() < log_size:
+                records.append(pickle.load(f))
+        return records
+
+    def load(self):
+        """
+        returns (state, processed image ids, table record parts) or None if there is no compatible checkpoint,
+        saving continues the loaded log
+        """
+        if not os.path.isfile(self.path):
+            return None
+        try:
+            with open(self.path, "rb") as f:
+                data = pickle.load(f)
+            if data.get("fingerprint") != self.fingerprint:
+                sly.logger.info("checkpoint is skipped: project meta or stats settings are changed")
+                return None
+            records = self._read_log(data["log_size"])
+        except Exception:
+            sly.logger.warn("checkpoint {!r} is corrupted, calculation starts from scratch".format(self.path),
+                            exc_info=True)
+            return None
+        self._log_size = data["log_size"]
+        image_ids = [image_id for record in records for image_id in record["ids"]]
+        tables = [record["table"] for record in records if record["table"] is not None]
+        return data["state"], image_ids, tables
+
+    def save(self, state, new_image_ids, new_table=None):
+        """state - small state of the whole run, new_image_ids / new_table - added since the previous save"""
+        mode = "wb" if self._log_size is None else "r+b"
+        with open(self.log_path, mode) as f:
+            # tail after the valid part (interrupted save) is overwritten
+            f.seek(sly.take_with_default(self._log_size, 0))
+            if len(new_image_ids) != 0:
+                pickle.dump({"ids": list(new_image_ids), "table": new_table}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.truncate()
+            f.flush()
+            os.fsync(f.fileno())
+            log_size = f.tell()
+
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump({"fingerprint": self.fingerprint, "log_size": log_size, "state": state}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+        self._log_size = log_size
+        self._saved_at = time.time()
+
+    def due(self):
+        return time.time() - self._saved_at >= self.interval_sec
+
+    def remove(self):
+        """removes the files, the next save starts a new log"""
+        for path in [self.path, self.log_path]:
+            if os.path.isfile(path):
+                os.remove(path)
+        self._log_size = None
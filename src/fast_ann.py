@@ -0,0 +1,111 @@
+import json
+
+import supervisely_lib as sly
+from supervisely_lib.api.module_api import ApiField
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads(data):
+    """decodes annotation json (bytes or str) with orjson if it's installed"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(data):
+    """compact json bytes of annotation (orjson if it's installed), keys keep their order"""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+class FastLabel:
+    """
+    Object of FastAnnotation: class is resolved by name, geometry is deserialized only on the first
+    access to .geometry (i.e. only for labels that are drawn), object tags are not parsed at all
+    """
+    __slots__ = ('obj_class', 'geometry_type', '_obj_json', '_meta', '_geometry')
+
+    def __init__(self, obj_class, obj_json, meta):
+        self.obj_class = obj_class
+        self.geometry_type = obj_json.get('geometryType')
+        self._obj_json = obj_json
+        self._meta = meta
+        self._geometry = None
+
+    @property
+    def geometry(self):
+        if self._geometry is None:
+            if self.obj_class.geometry_type is sly.AnyGeometry:
+                self._geometry = sly.Label.from_json(self._obj_json, self._meta).geometry
+            else:
+                self._geometry = self.obj_class.geometry_type.from_json(self._obj_json)
+        return self._geometry
+
+
+class FastAnnotation:
+    """
+    Subset of sly.Annotation needed for stats (img_size, labels, stat_class_count, stat_img_tags),
+    parsed from raw json without building and validating the whole object graph
+    """
+
+    def __init__(self, img_size, labels, img_tag_names):
+        self.img_size = img_size
+        self.labels = labels
+        self.img_tag_names = img_tag_names
+
+    @classmethod
+    def from_json(cls, data, meta: sly.ProjectMeta):
+        if isinstance(data, (bytes, str)):
+            data = loads(data)
+        size = data['size']
+        labels = []
+        for obj_json in data['objects']:
+            obj_class = meta.get_obj_class(obj_json['classTitle'])
+            if obj_class is None:
+                raise RuntimeError("Failed to deserialize a Label object from JSON: label class name {!r} "
+                                   "was not found in the given project meta.".format(obj_json['classTitle']))
+            labels.append(FastLabel(obj_class, obj_json, meta))
+        img_tag_names = [tag_json['name'] for tag_json in data.get('tags', [])]
+        return cls((size['height'], size['width']), labels, img_tag_names)
+
+    def stat_class_count(self, class_names):
+        # same result as sly.Annotation.stat_class_count
+        stat = {name: 0 for name in class_names}
+        for label in self.labels:
+            name = label.obj_class.name
+            if name not in stat:
+                raise KeyError("Class {!r} not found in {}".format(name, class_names))
+            stat[name] += 1
+        stat['total count'] = len(self.labels)
+        return stat
+
+    def stat_img_tags(self, tag_names):
+        # same result as sly.Annotation.stat_img_tags
+        stat = {name: 0 for name in tag_names}
+        stat['any tag'] = 0
+        for name in self.img_tag_names:
+            if name not in stat:
+                raise KeyError("Tag {!r} not found in {}".format(name, tag_names))
+            stat[name] += 1
+            stat['any tag'] += 1
+        return stat
+
+
+def download_raw_batch(api: sly.Api, dataset_id, image_ids):
+    """
+    annotations of the images as raw response bytes decoded by loads(), so orjson is used instead of
+    the json decoder of requests; returns (annotation jsons in the image_ids order, size of responses in bytes)
+    """
+    ann_jsons = {}
+    downloaded_bytes = 0
+    for batch in sly.batched(image_ids):
+        response = api.post('annotations.bulk.info', {ApiField.DATASET_ID: dataset_id, ApiField.IMAGE_IDS: batch})
+        downloaded_bytes += len(response.content)
+        for info in loads(response.content):
+            ann_jsons[info['imageId']] = info['annotation']
+    return [ann_jsons[image_id] for image_id in image_ids], downloaded_bytes
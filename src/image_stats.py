@@ -0,0 +1,180 @@
+import hashlib
+import math
+import time
+from collections import OrderedDict
+
+import numpy as np
+import supervisely_lib as sly
+
+import area
+from cache import meta_fingerprint
+from fast_ann import FastAnnotation, dumps, loads
+from instrumentation import Instrumentation
+
+# instrumentation counters
+EMPTY_COUNTER = "empty annotations"
+MEMO_HITS_COUNTER = "memo hits"
+MEMO_MISSES_COUNTER = "memo misses"
+
+# memory of a memo entry besides its arrays (key, tuple, array headers), bytes
+_MEMO_ENTRY_OVERHEAD = 300
+
+
+class ImageStats:
+    """
+    Calculates compact per-image stat rows: plain lists of numbers in the fixed column order
+    (see get_columns), so rows are cheap to pass between processes and to store.
+    fast_parse - annotations are parsed by FastAnnotation (geometries are built only for drawn labels),
+    mask_pool_mb - memory limit of reusable masks (see area.MaskPool), 0 - new mask for every image,
+    memo_mb - memory limit of LRU memo of results of identical annotations (0 - disabled), rows are kept
+    as compact float64 arrays, so the number of entries depends on the number of columns.
+    Rows of images without objects are built from size and tags only, without parsing and drawing
+    """
+
+    def __init__(self, meta: sly.ProjectMeta, area_backend=area.RASTER, approx_scale=None, approx_max_side=None,
+                 fast_parse=True, mask_pool_mb=256, memo_mb=64, instrumentation: Instrumentation = None):
+        self.meta = meta
+        self.memo_max_bytes = memo_mb * 1024 * 1024
+        self._memo = OrderedDict()  # hash of annotation json -> (row, area error, objects, bytes)
+        self._memo_bytes = 0
+        self._fingerprint = meta_fingerprint(meta, area_backend=area_backend, approx_scale=approx_scale,
+                                             approx_max_side=approx_max_side).encode('utf-8')
+        self.fast_parse = fast_parse
+        self.instrumentation = sly.take_with_default(instrumentation, Instrumentation(enabled=False))
+        self.mask_pool = area.MaskPool(mask_pool_mb * 1024 * 1024, self.instrumentation) if mask_pool_mb else None
+        self.area_backend = area_backend
+        self.approx_scale = approx_scale
+        self.approx_max_side = approx_max_side
+
+        self.class_names = []
+        self._name_to_index = {}  # 0 - for unlabeled area
+        for idx, obj_class in enumerate(meta.obj_classes):
+            self.class_names.append(obj_class.name)
+            self._name_to_index[obj_class.name] = idx + 1
+        self.tag_names = [tag_meta.name for tag_meta in meta.tag_metas]
+
+    def get_columns(self):
+        columns = ['height', 'width', 'channels', 'unlabeled area %', 'total count']
+        for name in self.class_names:
+            columns.append(area_name(name))
+            columns.append(count_name(name))
+        if len(self.tag_names) != 0:
+            columns.append('any tag')
+            columns.extend(self.tag_names)
+        return columns
+
+    def _objects(self, ann, image_area):
+        # [class index, area % of the image, bbox size (square root of bbox area) in pixels] of every label
+        objects = []
+        for label in ann.labels:
+            geometry = label.geometry
+            bbox = geometry.to_bbox()
+            objects.append([self._name_to_index[label.obj_class.name] - 1, geometry.area / image_area * 100.0,
+                            math.sqrt(bbox.height * bbox.width)])
+        return objects
+
+    def _empty_row(self, ann_json):
+        # whole image is unlabeled, same values as the full calculation gives
+        size = ann_json['size']
+        row = [size['height'], size['width'], area.RENDER_CHANNELS, 100.0, 0]
+        row.extend([0.0, 0] * len(self.class_names))
+        if len(self.tag_names) != 0:
+            img_tag_names = [tag_json['name'] for tag_json in ann_json.get('tags', [])]
+            stat_img_tags = FastAnnotation(None, [], img_tag_names).stat_img_tags(self.tag_names)
+            row.append(stat_img_tags['any tag'])
+            row.extend(stat_img_tags[name] for name in self.tag_names)
+        return row
+
+    def _memo_key(self, ann_json):
+        return hashlib.sha1(self._fingerprint + dumps(ann_json)).digest()
+
+    def calc(self, ann_json, image_key=None):
+        """
+        returns (row, estimated area error %, per-object values for histograms, see _objects),
+        image_key - (image id, image name) for instrumentation
+        """
+        instrumentation = self.instrumentation
+        start = time.perf_counter()
+
+        if isinstance(ann_json, (bytes, str)):
+            with instrumentation.stage("parse"):
+                ann_json = loads(ann_json)
+
+        if len(ann_json['objects']) == 0:
+            instrumentation.add_count(EMPTY_COUNTER)
+            with instrumentation.stage("empty"):
+                return self._empty_row(ann_json), 0, []
+
+        memo_key = None
+        if self.memo_max_bytes:
+            with instrumentation.stage("memo"):
+                memo_key = self._memo_key(ann_json)
+                result = self._memo.get(memo_key)
+            if result is not None:
+                self._memo.move_to_end(memo_key)
+                instrumentation.add_count(MEMO_HITS_COUNTER)
+                row, area_error, objects, _ = result
+                return row.tolist(), area_error, objects.tolist()
+            instrumentation.add_count(MEMO_MISSES_COUNTER)
+
+        with instrumentation.stage("parse"):
+            if self.fast_parse:
+                ann = FastAnnotation.from_json(ann_json, self.meta)
+            else:
+                ann = sly.Annotation.from_json(ann_json, self.meta)
+
+        with instrumentation.stage("rasterize"):
+            stat_area = area.stat_area(ann, self.class_names, self._name_to_index, percent=True,
+                                       backend=self.area_backend, scale=self.approx_scale,
+                                       max_side=self.approx_max_side, pool=self.mask_pool)
+
+        with instrumentation.stage("count"):
+            stat_count = ann.stat_class_count(self.class_names)
+
+            row = [stat_area['height'], stat_area['width'], stat_area['channels'],
+                   stat_area['unlabeled area %'], stat_count['total count']]
+            for name in self.class_names:
+                row.append(stat_area[name])
+                row.append(stat_count[name])
+
+            if len(self.tag_names) != 0:
+                stat_img_tags = ann.stat_img_tags(self.tag_names)
+                row.append(stat_img_tags['any tag'])
+                row.extend(stat_img_tags[name] for name in self.tag_names)
+
+        with instrumentation.stage("objects"):
+            objects = self._objects(ann, max(stat_area["height"] * stat_area["width"], 1))
+
+        if instrumentation.enabled:
+            image_id, image_name = sly.take_with_default(image_key, (None, None))
+            instrumentation.add_image_time(time.perf_counter() - start, image_id, image_name,
+                                           stat_area['height'], stat_area['width'], len(ann.labels))
+        result = row, stat_area.get(area.ERROR_FIELD, 0), objects
+        if memo_key is not None:
+            self._memoize(memo_key, result)
+        return result
+
+    def _memoize(self, memo_key, result):
+        row, area_error, objects = result
+        row = np.asarray(row, dtype=np.float64)
+        objects = np.asarray(objects, dtype=np.float64).reshape(-1, 3)
+        entry_bytes = row.nbytes + objects.nbytes + _MEMO_ENTRY_OVERHEAD
+        if entry_bytes > self.memo_max_bytes:
+            return
+        self._memo[memo_key] = (row, area_error, objects, entry_bytes)
+        self._memo_bytes += entry_bytes
+        while self._memo_bytes > self.memo_max_bytes:
+            _, (_, _, _, evicted_bytes) = self._memo.popitem(last=False)
+            self._memo_bytes -= evicted_bytes
+
+    def calc_batch(self, ann_jsons, image_keys=None):
+        image_keys = sly.take_with_default(image_keys, [None] * len(ann_jsons))
+        return [self.calc(ann_json, image_key) for ann_json, image_key in zip(ann_jsons, image_keys)]
+
+
+def area_name(name):
+    return "{} [area %]".format(name)
+
+
+def count_name(name):
+    return "{} [count]".format(name)
@@ -0,0 +1,30 @@
+from collections import Counter
+
+from area import RENDER_CHANNELS
+
+
+class InfoStats:
+    """
+    Project overview from image infos only (api.image.get_list), no annotations are needed: resolutions and
+    labeled / unlabeled images (by labels_count) of every dataset
+    """
+
+    def __init__(self):
+        self.resolutions = Counter()  # same keys as StatsAggregator.resolutions
+        self.datasets = []  # (dataset name, images count, labeled images count)
+
+    def add(self, dataset, images):
+        labeled = 0
+        for info in images:
+            self.resolutions["{} x {} x {}".format(info.height, info.width, RENDER_CHANNELS)] += 1
+            if info.labels_count:
+                labeled += 1
+        self.datasets.append((dataset.name, len(images), labeled))
+
+    @property
+    def images_count(self):
+        return sum(images_count for _, images_count, _ in self.datasets)
+
+    @property
+    def labeled_count(self):
+        return sum(labeled for _, _, labeled in self.datasets)
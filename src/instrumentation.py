@@ -0,0 +1,140 @@
+import heapq
+import threading
+import time
+
+import supervisely_lib as sly
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    __slots__ = ('_owner', '_name', '_wall', '_cpu')
+
+    def __init__(self, owner, name):
+        self._owner = owner
+        self._name = name
+
+    def __enter__(self):
+        self._wall = time.perf_counter()
+        self._cpu = time.thread_time()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._owner.add_stage(self._name, time.perf_counter() - self._wall, time.thread_time() - self._cpu)
+        return False
+
+
+class Instrumentation:
+    """
+    Cumulative wall/CPU time per pipeline stage (summed over all threads, so stages running concurrently
+    can take more time than the whole run), processed images, downloaded bytes (raw downloads only),
+    event counters (e.g. hits of the annotations memo) and the slowest images.
+    When disabled, every method is a no-op and stage() returns a shared dummy context manager
+    """
+
+    def __init__(self, enabled=True, slowest_count=10):
+        self.enabled = enabled
+        self.slowest_count = slowest_count
+        self._lock = threading.Lock()
+        self._started = time.time()
+        self.reset()
+
+    def reset(self):
+        self.stages = {}  # name -> [wall, cpu, calls]
+        self.images = 0
+        self.bytes_downloaded = 0
+        self.counters = {}
+        self._slowest = []  # min-heap of (seconds, image_id, image_name, height, width, labels_count)
+
+    def stage(self, name):
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name)
+
+    def add_stage(self, name, wall, cpu, calls=1):
+        with self._lock:
+            totals = self.stages.setdefault(name, [0.0, 0.0, 0])
+            totals[0] += wall
+            totals[1] += cpu
+            totals[2] += calls
+
+    def add_images(self, count):
+        if self.enabled:
+            with self._lock:
+                self.images += count
+
+    def add_bytes(self, count):
+        if self.enabled:
+            with self._lock:
+                self.bytes_downloaded += count
+
+    def add_count(self, name, count=1):
+        if self.enabled:
+            with self._lock:
+                self.counters[name] = self.counters.get(name, 0) + count
+
+    def add_image_time(self, seconds, image_id, image_name, height, width, labels_count):
+        if not self.enabled:
+            return
+        item = (seconds, image_id, image_name, height, width, labels_count)
+        with self._lock:
+            if len(self._slowest) < self.slowest_count:
+                heapq.heappush(self._slowest, item)
+            elif seconds > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, item)
+
+    def snapshot(self, reset=False):
+        """picklable state to send from worker processes, see merge()"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            result = {"stages": {name: list(totals) for name, totals in self.stages.items()},
+                      "images": self.images, "bytes": self.bytes_downloaded, "counters": dict(self.counters),
+                      "slowest": list(self._slowest)}
+            if reset:
+                self.reset()
+        return result
+
+    def merge(self, snapshot):
+        if not self.enabled or snapshot is None:
+            return
+        for name, (wall, cpu, calls) in snapshot["stages"].items():
+            self.add_stage(name, wall, cpu, calls)
+        self.add_images(snapshot["images"])
+        self.add_bytes(snapshot["bytes"])
+        for name, count in snapshot["counters"].items():
+            self.add_count(name, count)
+        for item in snapshot["slowest"]:
+            self.add_image_time(*item)
+
+    def to_dict(self):
+        if not self.enabled:
+            return None
+        elapsed = time.time() - self._started
+        with self._lock:
+            return {
+                "elapsedSec": round(elapsed, 2),
+                "images": self.images,
+                "imagesPerSec": round(self.images / elapsed, 2) if elapsed > 0 else 0,
+                "bytesDownloaded": self.bytes_downloaded,
+                "stages": [{"stage": name, "wallSec": round(wall, 3), "cpuSec": round(cpu, 3), "calls": calls}
+                           for name, (wall, cpu, calls) in self.stages.items()],
+                "counters": [{"counter": name, "value": value} for name, value in self.counters.items()],
+                "slowestImages": [{"id": image_id, "name": image_name, "sec": round(seconds, 3),
+                                   "height": height, "width": width, "labels": labels_count}
+                                  for seconds, image_id, image_name, height, width, labels_count
+                                  in sorted(self._slowest, reverse=True)],
+            }
+
+    def log(self):
+        if self.enabled:
+            sly.logger.info("stats pipeline instrumentation", extra={"instrumentation": self.to_dict()})
@@ -0,0 +1,93 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import supervisely_lib as sly
+
+
+class LookupCache:
+    """
+    Project meta and team/workspace infos shared between jobs of the long-lived app. Meta is keyed by
+    project updated_at as well, every entry expires after ttl_sec
+    """
+
+    def __init__(self, ttl_sec=600):
+        self.ttl_sec = ttl_sec
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _get(self, key, load):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[0] < self.ttl_sec:
+                return entry[1]
+        value = load()
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+        return value
+
+    def workspace(self, api: sly.Api, workspace_id):
+        return self._get(("workspace", workspace_id), lambda: api.workspace.get_info_by_id(workspace_id))
+
+    def team(self, api: sly.Api, team_id):
+        return self._get(("team", team_id), lambda: api.team.get_info_by_id(team_id))
+
+    def meta_json(self, api: sly.Api, project):
+        return self._get(("meta", project.id, getattr(project, "updated_at", None)),
+                         lambda: api.project.get_meta(project.id))
+
+
+class JobManager:
+    """
+    Runs calculations of several projects concurrently (at most max_jobs at once). Every job takes worker
+    processes and connections (download threads + listing requests) from the global budgets and waits
+    until they are available, requests bigger than the budget are reduced to it.
+    Only one job per data field (namespace of the job results in app data) may run at once
+    """
+
+    def __init__(self, max_jobs=2, worker_budget=4, connection_budget=16):
+        self.worker_budget = worker_budget
+        self.connection_budget = connection_budget
+        self._free_workers = worker_budget
+        self._free_connections = connection_budget
+        self._condition = threading.Condition()
+        self._running_fields = set()
+        self._executor = ThreadPoolExecutor(max_workers=max_jobs)
+
+    def _acquire(self, workers, connections):
+        with self._condition:
+            self._condition.wait_for(lambda: self._free_workers >= workers and
+                                     self._free_connections >= connections)
+            self._free_workers -= workers
+            self._free_connections -= connections
+
+    def _release(self, workers, connections):
+        with self._condition:
+            self._free_workers += workers
+            self._free_connections += connections
+            self._condition.notify_all()
+
+    def _run(self, func, field, state):
+        workers = min(max(state.get("workers", 1), 1), self.worker_budget)
+        download_threads = min(state.get("downloadThreads", 2), self.connection_budget)
+        list_concurrency = min(state.get("listConcurrency", 8), max(self.connection_budget - download_threads, 1))
+        connections = min(download_threads + list_concurrency, self.connection_budget)
+        self._acquire(workers, connections)
+        try:
+            func({**state, "workers": workers, "downloadThreads": download_threads,
+                  "listConcurrency": list_concurrency})
+        except Exception:
+            sly.logger.error("job {!r} failed".format(field), exc_info=True)
+        finally:
+            self._release(workers, connections)
+            with self._condition:
+                self._running_fields.discard(field)
+
+    def submit(self, func, field, state):
+        """func(state) is called with workers/downloadThreads/listConcurrency fitted to the budgets"""
+        with self._condition:
+            if field in self._running_fields:
+                sly.logger.warn("job {!r} is already running, command is skipped".format(field))
+                return None
+            self._running_fields.add(field)
+        return self._executor.submit(self._run, func, field, state)
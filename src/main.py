@@ -1,329 +1,109 @@
-import numpy as np
-import pandas as pd
-import json
-import plotly.express as px
-import plotly.graph_objects as go
+import os
 import sys
 
 import supervisely_lib as sly
 
-my_app = sly.AppService()
+# project of the app UI (results in "data"), other projects can be calculated by "calculate" command
+# with context.projectId, their results are pushed to "data.jobs.<project id>" (or context.dataField);
+# the app is started from a project, there is no default one
+PROJECT_ID = int(os.environ["context.projectId"]) if os.environ.get("context.projectId") else None
 
-BG_COLOR = [0, 0, 0]
+# app service and concurrent calculations are created in main(): worker processes (forkserver) import this
+# module as __mp_main__, so nothing is created and the report stack is not imported at module level
+my_app = None
+job_manager = None
 
 
-def area_name(name):
-    return "{} [area %]".format(name)
+def _job_target(context, state):
+    ui_project_id = state.get("projectId", PROJECT_ID)
+    project_id = context.get("projectId", ui_project_id)
+    if project_id is None:
+        raise ValueError("Project ID is not set: pass context.projectId to the command or start the app "
+                         "from a project")
+    field = context.get("dataField")
+    if field is None:
+        field = "data" if project_id == ui_project_id else "data.jobs.{}".format(project_id)
+    return project_id, field
 
 
-def count_name(name):
-    return "{} [count]".format(name)
+def _register_callbacks(app: sly.AppService):
+    from report import calculate_stats, merge_shards, push_table_page, request_stop
 
+    @app.callback(sly.app.STOP_COMMAND)
+    def stop(api: sly.Api, task_id, context, state):
+        # running calculation saves checkpoint and pushes partial results before exit
+        request_stop()
+        sys.exit(0)
 
-def color_name(name, color):
-    return '<b style="display: inline-block; border-radius: 50%; background: {}; width: 8px; height: 8px"></b> {}'.format(sly.color.rgb2hex(color), name)
+    def _submit(api, task_id, project_id, field, state):
+        @sly.timeit
+        def calculate_job(job_state):
+            calculate_stats(api, task_id, project_id, job_state, field=field)
 
+        sly.logger.info("calculation of project {} is submitted, results -> {!r}".format(project_id, field))
+        job_manager.submit(calculate_job, field, state)
 
-def color_tag_name(name, color):
-    return '<i class="zmdi zmdi-label" style="color:{};margin-right:3px"></i>{}'.format(sly.color.rgb2hex(color), name)
+    @app.callback("calculate")
+    def calculate(api: sly.Api, task_id, context, state):
+        project_id, field = _job_target(context, state)
+        _submit(api, task_id, project_id, field, state)
 
+    @app.callback("calculate_full")
+    def calculate_full(api: sly.Api, task_id, context, state):
+        # annotations pass on user request after the quick report (fullPass is false)
+        project_id, field = _job_target(context, state)
+        _submit(api, task_id, project_id, field, {**state, "fullPass": True})
 
-def rename_fields(data, old_names, new_name_func, colors=None, color_func=None):
-    colors = sly.take_with_default(colors, [None] * len(old_names))
-    for name, color in zip(old_names, colors):
-        if name in data:
-            new_name = new_name_func(name)
-            if color is not None and color_func is not None:
-                new_name = color_func(new_name, color)
-            data[new_name] = data[name]
-            del data[name]
+    @app.callback("merge_shards")
+    def merge_shards_command(api: sly.Api, task_id, context, state):
+        # coordinator of the sharded calculation: state.shardCount partial results -> charts of the whole project
+        project_id, field = _job_target(context, state)
 
+        @sly.timeit
+        def merge_job(job_state):
+            merge_shards(api, task_id, project_id, job_state, field=field)
 
-@my_app.callback(sly.app.STOP_COMMAND)
-def stop(api: sly.Api, task_id, context, state):
-    sys.exit(0)
+        job_manager.submit(merge_job, field, state)
 
-
-@my_app.callback("calculate")
-@sly.timeit
-def calculate(api: sly.Api, task_id, context, state):
-    project_id = 502 #context.get("project_id")
-    project = api.project.get_info_by_id(project_id)
-    if project is None:
-        raise RuntimeError("Project ID={!r} not found".format(project_id))
-    if project.type != str(sly.ProjectType.IMAGES):
-        raise RuntimeError('Project {!r} has type {!r}. This script works only with {!r} projects'
-                           .format(project.name, project.type, str(sly.ProjectType.IMAGES)))
-
-    workspace = api.workspace.get_info_by_id(project.workspace_id)
-    team = api.team.get_info_by_id(workspace.team_id)
-
-    sly.logger.info("team: {}".format(team.name))
-    sly.logger.info("workspace: {}".format(workspace.name))
-    sly.logger.info("project: {}".format(project.name))
-
-    meta_json = api.project.get_meta(project_id)
-    meta = sly.ProjectMeta.from_json(meta_json)
-
-    # list classes (used when several classes have the same colors )
-    class_names = []
-    class_colors = []
-    class_indices = []  # 0 - for unlabeled area
-    class_indices_colors = []
-    _name_to_index = {}
-    for idx, obj_class in enumerate(meta.obj_classes):
-        class_names.append(obj_class.name)
-        class_colors.append(obj_class.color)
-        class_index = idx + 1
-        class_indices.append(class_index)
-        class_indices_colors.append([class_index, class_index, class_index])
-        _name_to_index[obj_class.name] = class_index
-
-    # list tags
-    tag_names = []
-    tag_colors = []
-    for tag_meta in meta.tag_metas:
-        tag_names.append(tag_meta.name)
-        tag_colors.append(tag_meta.color)
-
-    # pandas dataframe columns orders
-    cols_ordered = ['id', 'name', 'dataset', 'height', 'width', 'channels', 'unlabeled area %', 'total count']
-    classes_cols = []
-    for name, color in zip(class_names, class_colors):
-        classes_cols.append(color_name(area_name(name), color))
-        classes_cols.append(color_name(count_name(name), color))
-    tags_cols = ['any tag']
-    for name, color in zip(tag_names, tag_colors):
-        tags_cols.append(color_tag_name(name, color))
-
-    total_images_count = api.project.get_images_count(project.id)
-    table_per_image_stats = []
-    df_per_image_stats = None
-
-    for dataset in api.dataset.get_list(project.id):
-        images = api.image.get_list(dataset.id)
-        ds_progress = sly.Progress('Dataset {}'.format(dataset.name), total_cnt=len(images))
-
-        for batch in sly.batched(images):
-            table_batch = []
-            image_ids = [image_info.id for image_info in batch]
-            #image_names = [image_info.name for image_info in batch]
-
-            ann_infos = api.annotation.download_batch(dataset.id, image_ids)
-            ann_jsons = [ann_info.annotation for ann_info in ann_infos]
-
-            for info, ann_json in zip(batch, ann_jsons):
-                ann = sly.Annotation.from_json(ann_json, meta)
-
-                render_img = np.zeros(ann.img_size + (3,), dtype=np.uint8)
-                render_img[:] = BG_COLOR
-                ann.draw(render_img)
-
-                render_idx_rgb = np.zeros(ann.img_size + (3,), dtype=np.uint8)
-                render_idx_rgb[:] = BG_COLOR
-                ann.draw_class_idx_rgb(render_idx_rgb, _name_to_index)
-
-                temp_area = sly.Annotation.stat_area(render_idx_rgb, class_names, class_indices_colors, percent=True)
-                rename_fields(temp_area, class_names, area_name, class_colors, color_name)
-
-                temp_count = ann.stat_class_count(class_names)
-                rename_fields(temp_count, class_names, count_name, class_colors, color_name)
-
-                temp_img_tags = {}
-                if len(tag_names) != 0:
-                    temp_img_tags = ann.stat_img_tags(tag_names)
-                    rename_fields(temp_img_tags, tag_names, lambda x: x, tag_colors, color_tag_name)
-
-                temp_area['id'] = info.id
-                temp_area['dataset'] = dataset.name
-                temp_area['name'] = '<a href="{0}" rel="noopener noreferrer" target="_blank">{1}</a>' \
-                    .format(api.image.url(team.id, workspace.id, project.id, dataset.id, info.id), info.name)
-
-                table_batch.append({**temp_area, **temp_count, **temp_img_tags})
-
-            ds_progress.iters_done_report(len(batch))
-            table_per_image_stats.extend(table_batch)
-
-            # use pandas.dataframe to round floats and set columns order
-            df = pd.read_json(json.dumps(table_batch, cls=sly._utils.NpEncoder), orient='records')
-            df = df.round(1)
-
-            if len(tag_names) != 0:
-                df = df[[*cols_ordered, *classes_cols, *tags_cols]]
-            else:
-                df = df[[*cols_ordered, *classes_cols]]
-
-            processed_table_part = json.loads(df.to_json(orient='split'))
-            if df_per_image_stats is None:
-                df_per_image_stats = df
-            else:
-                df_per_image_stats = pd.concat([df_per_image_stats, df], ignore_index=True, sort=False)
-
-            # refresh table and progress
-            payload = {
-                "tablePerImageStats": processed_table_part,
-                "progress": int(len(table_per_image_stats) / total_images_count * 100)
-            }
-            api.app.set_data(task_id, payload, "data", append=True)
-
-    # ==================================================================================================================
-    # average class area per image
-    # ==================================================================================================================
-    class_area_nonzero = []
-    class_count_nonzero = []
-
-    images_with_count = []
-    images_with_count_text = []
-    images_without_count = []
-    images_without_count_text = []
-
-    unlabeled_col_name = 'unlabeled area %'
-    for name, color in zip([unlabeled_col_name, *class_names], [None, *class_colors]):
-        # print(name)
-        if name == unlabeled_col_name:
-            col_name = unlabeled_col_name
-        else:
-            col_name = color_name(area_name(name), color)
-
-        area_col = df_per_image_stats[col_name].copy()
-        area_col = area_col.replace(0, np.NaN)
-        area = area_col.mean(skipna=True)
-        class_area_nonzero.append(area if area is not np.NaN else 0)
-
-        count = np.NaN
-        if name == unlabeled_col_name:
-            count = np.NaN
-        else:
-            count_col = df_per_image_stats[color_name(count_name(name), color)].copy()
-            count_col = count_col.replace(0, np.NaN)
-            count = count_col.mean(skipna=True)
-        class_count_nonzero.append(count if count is not np.NaN else 0)
-
-        if name == unlabeled_col_name:
-            continue
-
-        without_count = count_col.isna().sum()
-        with_count = len(count_col) - without_count
-        images_with_count.append(with_count)
-        images_with_count_text.append("{} ({:.2f} %)".format(with_count, with_count * 100 / total_images_count))
-        images_without_count.append(without_count)
-        images_without_count_text.append(
-            "{} ({:.2f} %)".format(without_count, without_count * 100 / total_images_count))
-
-        # @TODO: uncomment (use only for debug)
-        #if with_count + without_count != total_images_count:
-        #    raise RuntimeError("Some images are missed")
-
-    fig = go.Figure(
-        data=[
-            go.Bar(name='Area %', x=[unlabeled_col_name, *class_names], y=class_area_nonzero, yaxis='y', offsetgroup=1),
-            go.Bar(name='Count', x=[unlabeled_col_name, *class_names], y=class_count_nonzero, yaxis='y2', offsetgroup=2)
-        ],
-        layout={
-            'yaxis': {'title': 'Area'},
-            'yaxis2': {'title': 'Count', 'overlaying': 'y', 'side': 'right'}
-        }
-    )
-    fig.update_layout(barmode='group')
-    payload = {
-        "classAreaDistr": json.loads(fig.to_json()),
-        "loadingClassAreaDistr": False
-    }
-    api.app.set_data(task_id, payload, "data", append=True)
-
-    # ==================================================================================================================
-    # images count with/without classes
-    # ==================================================================================================================
-    fig_with_without_count = go.Figure(
-        data=[
-            go.Bar(name='# of images that have class', x=class_names, y=images_with_count, text=images_with_count_text),
-            go.Bar(name='# of images that do not have class', x=class_names, y=images_without_count,
-                   text=images_without_count_text)
-        ],
-    )
-    fig_with_without_count.update_layout(barmode='stack')  # , legend_orientation="h")
-    payload = {
-        "classOnImageCount": json.loads(fig_with_without_count.to_json()),
-        "loadingClassOnImageCount": False
-    }
-    api.app.set_data(task_id, payload, "data", append=True)
-
-    # ==================================================================================================================
-    # images with without tags
-    # ==================================================================================================================
-    if len(tag_names) != 0:
-        col_tags_count = 'any tag'
-        # images with without tags
-        images_with_tag_count = []
-        images_with_tag_count_text = []
-
-        images_without_tag_count = []
-        images_without_tag_count_text = []
-        for name, color in zip([col_tags_count, *tag_names], [None, *tag_colors]):
-            if name != col_tags_count:
-                name = color_tag_name(name, color)
-            tag_col = df_per_image_stats[name].copy()
-            tag_col = df_per_image_stats[tag_col > 0]
-
-            with_tag = len(tag_col)
-            images_with_tag_count.append(with_tag)
-            images_with_tag_count_text.append(
-                "{} ({:.2f} %)".format(with_tag, with_tag * 100 / total_images_count))
-
-            without_tag = total_images_count - with_tag
-            images_without_tag_count.append(without_tag)
-            images_without_tag_count_text.append(
-                "{} ({:.2f} %)".format(without_tag, without_tag * 100 / total_images_count))
-
-        fig_tag_with_without_count = go.Figure(
-            data=[
-                go.Bar(name='# of images that have tag',
-                       x=[col_tags_count, *tag_names], y=images_with_tag_count,
-                       text=images_with_tag_count_text),
-                go.Bar(name='# of images that do not have tag',
-                       x=[col_tags_count, *tag_names], y=images_without_tag_count,
-                       text=images_without_tag_count_text)
-            ],
-        )
-        fig_tag_with_without_count.update_layout(barmode='stack')
-
-        payload = {
-            "tagOnImageCount": json.loads(fig_tag_with_without_count.to_json()),
-            "loadingTagOnImageCount": False
-        }
-        api.app.set_data(task_id, payload, "data", append=True)
-
-    # ==================================================================================================================
-    # images resolution (piechart)
-    # ==================================================================================================================
-    df_per_image_stats["resolution"] = df_per_image_stats["height"].astype(str) + " x " \
-                                       + df_per_image_stats["width"].astype(str) + " x " \
-                                       + df_per_image_stats["channels"].astype(str)
-
-    labels = df_per_image_stats["resolution"].value_counts().index
-    values = df_per_image_stats["resolution"].value_counts().values
-
-    df_resolution = pd.DataFrame({'resolution': labels, 'count': values})
-    df_resolution['percent'] = df_resolution['count'] / df_resolution['count'].sum() * 100
-    # df_resolution['percent'].apply("{:.2f}".format)
-    # df_resolution = df_resolution.sort_values('percent', ascending=False)
-    df_resolution.loc[df_resolution.index > 10, 'resolution'] = 'other'
-
-    pie_resolution = px.pie(df_resolution, names='resolution', values='count')  # labels='text')
-    payload = {
-        "imageResolutionDistr": json.loads(pie_resolution.to_json()),
-        "loadingImageResolutionDistr": False
-    }
-    api.app.set_data(task_id, payload, "data", append=True)
+    @app.callback("get_table_page")
+    def get_table_page(api: sly.Api, task_id, context, state):
+        _, field = _job_target(context, state)
+        push_table_page(api, task_id, state, field=field)
 
 
 def main():
-    table = []
+    global my_app, job_manager
+    from jobs import JobManager
+
+    if PROJECT_ID is None:
+        raise RuntimeError("Project ID is not set (context.projectId), the app has to be started from a project")
+    my_app = sly.AppService()
+    _register_callbacks(my_app)
+    # page of the per-image table, "split" orient (see StatsTable.query)
+    table = {"columns": [], "index": [], "data": []}
 
     # data
     data = {
         "tablePerImageStats": table,
         "progress": 0,
+        "tableTotalRows": 0,
+        "tableColumns": [],
+        "instrumentation": None,
+        # whether the area backend is "approximate", pushed by every calculation of the field
+        "areaApproximate": False,
+        "areaErrorBound": 0,
+
+        # project overview from image infos only (quick report)
+        "imagesCount": 0,
+        "labeledImagesCount": 0,
+        "quickOnly": False,
+        # images restored from checkpoint of the previous (interrupted) run, calculation is stopped by user
+        "resumedImages": 0,
+        "stopped": False,
+        # message of the failed calculation, charts loaders are hidden
+        "error": None,
+        "datasetImagesDistr": {},
+        "loadingDatasetImagesDistr": True,
 
         "classAreaDistr":  {},
         "loadingClassAreaDistr": True,
@@ -331,26 +111,115 @@ def main():
         "classOnImageCount": {},
         "loadingClassOnImageCount": True,
 
+        # p50/p90/p99 of area, count and object size of every class
+        "classQuantiles": {},
+        "loadingClassQuantiles": True,
+        # percentiles are of the previous complete run (saved sketches) until the first refresh
+        "classQuantilesPrevious": False,
+
+        "classCooccurrence": {},
+        "loadingClassCooccurrence": True,
+
+        # per-object histograms of every class: area % and bbox size
+        "objectAreaDistr": {},
+        "loadingObjectAreaDistr": True,
+        "objectSizeDistr": {},
+        "loadingObjectSizeDistr": True,
+
         "tagOnImageCount": {},
         "loadingTagOnImageCount": True,
 
         "imageResolutionDistr": {},
-        "loadingImageResolutionDistr": True
+        "loadingImageResolutionDistr": True,
+
+        # results of the other projects calculations by project id (see _job_target)
+        "jobs": {}
     }
 
     # state
     state = {
+        "projectId": PROJECT_ID,
+        # calculations of several projects run concurrently, at most maxJobs at once; they share
+        # maxWorkers processes and maxConnections download/listing connections
+        "maxJobs": 2,
+        "maxWorkers": 4,
+        "maxConnections": 16,
+
         "perPage": 25,
         "pageSizes": [25, 50, 100],
         "processingFlag": True,
         "fixColumns": 2,
-
+        # per-image table is paginated, sorted and filtered in the app (see "get_table_page" command)
+        "tablePage": 1,
+        "tableSortColumn": None,
+        "tableSortOrder": "asc",
+        "tableFilter": "",
+
+        # "raster" - draw labels on class-index mask, "analytic" - areas from geometries (pixel-exact
+        # for rectangles and bitmaps, within a few pixels for polygons),
+        # "approximate" - draw labels on downscaled mask: scaled by approxScale if it's set, otherwise
+        # to approxMaxSide (1024 if both are None)
+        "areaBackend": "raster",
+        "approxScale": None,
+        "approxMaxSide": None,
+
+        # number of processes for per-image stats (1 - calculate in the app process)
+        "workers": 1,
+        # sharded calculation: this instance calculates only shardIndex-th of shardCount parts of the project
+        # (split by "dataset" or by "hash" of image id) and saves partial result to shardDir (with per-image
+        # rows if shardTableRows), "merge_shards" command merges partials into the charts of the whole project
+        "shardCount": 1,
+        "shardIndex": 0,
+        "shardBy": "hash",
+        "shardTableRows": False,
+
+        # memory of reusable masks in every worker, MB (0 - masks are allocated for every image)
+        "maskPoolMb": 256,
+
+        # annotations download: number of threads and max number of batches downloaded ahead
+        "downloadThreads": 2,
+        "prefetchDepth": 4,
+        # max number of concurrent api.image.get_list requests
+        "listConcurrency": 8,
+        # lightweight annotations parsing (orjson is used for downloaded annotations if it's installed)
+        "fastParse": True,
+        # results of identical annotations (same json) are reused within the run, LRU of annMemoMb MB in every
+        # worker (0 - disabled); images without objects are never drawn
+        "annMemoMb": 64,
+
+        # overview charts from image infos before the annotations pass, fullPass - whether to
+        # continue with annotations automatically (otherwise it's started by "calculate_full" command)
+        "quickReport": True,
+        "fullPass": True,
+
+        # keep (and show) per-image table, summary charts are refreshed every chartsRefreshSec seconds
+        "perImageTable": True,
+        "chartsRefreshSec": 10,
+
+        # reuse per-image stats of the unchanged images from the previous runs
+        "useCache": True,
+
+        # partial results are saved every checkpointSec seconds (None - disabled), restarted task
+        # for the same project and settings resumes from the checkpoint
+        "checkpointSec": 60,
+
+        # time of every pipeline stage, throughput and the slowest images (data.instrumentation)
+        "instrumentation": True,
+        "instrumentationRefreshSec": 5,
+
+        # data updates are coalesced and pushed at most every pushIntervalMs, a request carries at most
+        # pushMaxBytes of fields (bigger updates are split into several requests)
+        "pushIntervalMs": 1000,
+        "pushMaxBytes": 4194304,
     }
 
+    job_manager = JobManager(max_jobs=state["maxJobs"], worker_budget=state["maxWorkers"],
+                             connection_budget=state["maxConnections"])
+
     # start event after successful service run
     events = [
         {
-            "state": {},
+            "state": state,
             "context": {},
             "command": "calculate"
         }
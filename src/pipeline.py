@@ -0,0 +1,119 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import supervisely_lib as sly
+
+import fast_ann
+from instrumentation import Instrumentation
+
+_DONE = object()
+
+
+def _list_images(api, dataset_id, instrumentation):
+    with instrumentation.stage("list images"):
+        return api.image.get_list(dataset_id)
+
+
+def list_datasets_images(api: sly.Api, datasets, concurrency=8, instrumentation: Instrumentation = None):
+    """
+    Lists images of all datasets concurrently (at most `concurrency` requests at once) and yields
+    (dataset, images) in the datasets order as soon as every listing is ready
+    """
+    instrumentation = sly.take_with_default(instrumentation, Instrumentation(enabled=False))
+    executor = ThreadPoolExecutor(max_workers=max(concurrency, 1))
+    try:
+        futures = [(dataset, executor.submit(_list_images, api, dataset.id, instrumentation)) for dataset in datasets]
+        for dataset, future in futures:
+            yield dataset, future.result()
+    finally:
+        executor.shutdown(wait=False)
+
+
+def _download_annotations(api, dataset_id, image_ids, instrumentation, raw=False):
+    with instrumentation.stage("download"):
+        if raw:
+            ann_jsons, downloaded_bytes = fast_ann.download_raw_batch(api, dataset_id, image_ids)
+            instrumentation.add_bytes(downloaded_bytes)
+        else:
+            # response body is not available from download_batch, its size is not counted
+            ann_jsons = [ann_info.annotation for ann_info in api.annotation.download_batch(dataset_id, image_ids)]
+    return ann_jsons
+
+
+class AnnotationPrefetcher:
+    """
+    Three stage pipeline: producer thread lists images of all datasets concurrently and submits annotation
+    downloads to a thread pool, so batches of the next datasets are downloaded while the previous ones are
+    calculated. Consumer iterates over (dataset, dataset_images_count, batch, ann_jsons, cached) in the original
+    order, where `cached` is {image_id: stats} for images found in the cache (their annotations are not
+    downloaded, ann_jsons are given only for the rest images of the batch).
+    At most queue_depth batches are downloaded ahead of the consumer, it limits the memory usage.
+    dataset_images - already listed [(dataset, images)], datasets are not listed again then.
+    skip_ids - ids of images that are already processed (e.g. restored from a checkpoint), they are not yielded
+    raw_download - responses are decoded by orjson (if it's installed) instead of the json decoder of requests
+    """
+
+    def __init__(self, api: sly.Api, datasets, download_threads=2, queue_depth=4, list_concurrency=8, cache=None,
+                 raw_download=True, dataset_images=None, skip_ids=None, instrumentation: Instrumentation = None):
+        self.api = api
+        self.skip_ids = skip_ids
+        self.dataset_images = dataset_images
+        self.raw_download = raw_download and fast_ann.orjson is not None
+        self.cache = cache
+        self.instrumentation = sly.take_with_default(instrumentation, Instrumentation(enabled=False))
+        self.datasets = datasets
+        self.download_threads = download_threads
+        self.list_concurrency = list_concurrency
+        self._queue = queue.Queue(maxsize=queue_depth)
+        self._stop = threading.Event()
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _produce(self, executor):
+        try:
+            dataset_images = self.dataset_images
+            if dataset_images is None:
+                dataset_images = list_datasets_images(self.api, self.datasets, self.list_concurrency,
+                                                      self.instrumentation)
+            for dataset, images in dataset_images:
+                if self.skip_ids:
+                    images = [info for info in images if info.id not in self.skip_ids]
+                for batch in sly.batched(images):
+                    cached = {}
+                    if self.cache is not None:
+                        with self.instrumentation.stage("cache"):
+                            cached = self.cache.get_many(batch)
+                    image_ids = [image_info.id for image_info in batch if image_info.id not in cached]
+                    future = executor.submit(_download_annotations, self.api, dataset.id, image_ids,
+                                             self.instrumentation, self.raw_download) if len(image_ids) != 0 else None
+                    if not self._put((dataset, len(images), batch, future, cached)):
+                        return
+            self._put(_DONE)
+        except Exception as e:
+            self._put(e)
+
+    def __iter__(self):
+        executor = ThreadPoolExecutor(max_workers=self.download_threads)
+        producer = threading.Thread(target=self._produce, args=(executor,), daemon=True)
+        producer.start()
+        try:
+            while True:
+                item = self._queue.get()
+                if item is _DONE:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                dataset, images_count, batch, future, cached = item
+                yield dataset, images_count, batch, future.result() if future is not None else [], cached
+        finally:
+            self._stop.set()
+            producer.join()
+            executor.shutdown(wait=False)
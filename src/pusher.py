@@ -0,0 +1,67 @@
+import json
+import time
+
+import supervisely_lib as sly
+
+from instrumentation import Instrumentation
+
+
+class DataPusher:
+    """
+    Coalesces api.app.set_data updates: every field keeps only the last value and is sent only if it changed
+    since the previous flush. Pending updates are flushed at most every interval_ms, a single request carries
+    at most max_bytes of serialized fields (fields of bigger flushes are split into several requests, a field
+    bigger than max_bytes is sent alone)
+    """
+
+    def __init__(self, api: sly.Api, task_id, field="data", interval_ms=1000, max_bytes=4 * 1024 * 1024,
+                 instrumentation: Instrumentation = None):
+        self.api = api
+        self.task_id = task_id
+        self.field = field
+        self.interval_ms = interval_ms
+        self.max_bytes = max_bytes
+        self.instrumentation = sly.take_with_default(instrumentation, Instrumentation(enabled=False))
+
+        self._pending_fields = {}
+        self._sent_fields = {}
+        self._flushed_at = time.time()
+        self.requests = 0
+
+    def set(self, payload):
+        self._pending_fields.update(payload)
+
+    def maybe_flush(self):
+        if (time.time() - self._flushed_at) * 1000 >= self.interval_ms:
+            self.flush()
+
+    def _send(self, payload):
+        with self.instrumentation.stage("push"):
+            self.api.app.set_data(self.task_id, payload, self.field, append=True)
+        self.requests += 1
+
+    def _chunks(self, fields):
+        # fields are grouped to keep every request under max_bytes
+        chunk, chunk_bytes = {}, 0
+        for key, value in fields.items():
+            field_bytes = len(json.dumps({key: value}))
+            if len(chunk) != 0 and chunk_bytes + field_bytes > self.max_bytes:
+                yield chunk
+                chunk, chunk_bytes = {}, 0
+            if field_bytes > self.max_bytes:
+                sly.logger.warn("field {!r} ({} bytes) exceeds push limit {} bytes".format(key, field_bytes,
+                                                                                         self.max_bytes))
+            chunk[key] = value
+            chunk_bytes += field_bytes
+        if len(chunk) != 0:
+            yield chunk
+
+    def flush(self):
+        # only changed fields (deltas) are sent
+        fields = {key: value for key, value in self._pending_fields.items()
+                  if key not in self._sent_fields or self._sent_fields[key] != value}
+        self._sent_fields.update(fields)
+        self._pending_fields = {}
+        for chunk in self._chunks(fields):
+            self._send(chunk)
+        self._flushed_at = time.time()
@@ -3,37 +3,59 @@
 import numpy as np
 from collections import defaultdict
 import supervisely_lib as sly
-import json
 import pandas as pd
 import os
 import plotly.express as px
 import plotly.graph_objects as go
 import plotly.offline as po
 import random
+import sys
+
+import charts
+from aggregator import CLASSES_OFFSET
+from image_stats import ImageStats, area_name, count_name
+from info_stats import InfoStats
+from pipeline import list_datasets_images
+from sampling import ConvergenceTracker, stratified_batches
+from table import StatsTable
 
 
 workspace_id = '%%WORKSPACE_ID%%'
 project_name = '%%IN_VIDEO_PROJECT_NAME%%'
 src_dataset_ids = '%%DATASET_IDS:None%%'
 sample_ratio = '%%SAMPLE_RATIO:None%%'
+# progressive sampling: images are processed in stratified random order until confidence intervals of
+# per-class mean area %, mean count and presence % are narrower than +-tolerance (sample_ratio is ignored)
+sample_tolerance = '%%SAMPLE_TOLERANCE:None%%'
+sample_confidence = '%%SAMPLE_CONFIDENCE:0.95%%'
+# quick report: only charts from image infos (resolutions, labeled/unlabeled images of datasets),
+# annotations are not downloaded
+quick_report = '%%QUICK_REPORT:False%%'
 
 # workspace_id = '1'
 # project_name = 'pascal_colors'
 # src_dataset_ids = 'None'
 # sample_ratio = '0.01'
+# sample_tolerance = '0.5'
+# quick_report = 'True'
 
 
 workspace_id = sly.ps.str_to_type_or_none(workspace_id, target_type=int)
 src_dataset_ids = sly.ps.str_to_type_or_none(src_dataset_ids, target_type=list)
 sample_ratio = sly.ps.str_to_type_or_none(sample_ratio, target_type=float)
+sample_tolerance = sly.ps.str_to_type_or_none(sample_tolerance, target_type=float)
+sample_confidence = sly.ps.str_to_type_or_none(sample_confidence, target_type=float)
+quick_report = str(quick_report).lower() in ['true', '1']
 
 sly.logger.info("workspace_id: {}".format(workspace_id))
 sly.logger.info("project_name: {}".format(project_name))
 sly.logger.info("src_dataset_ids: {}".format(src_dataset_ids))
 sly.logger.info("sample_ratio: {}".format(sample_ratio))
+sly.logger.info("sample_tolerance: {}".format(sample_tolerance))
+sly.logger.info("sample_confidence: {}".format(sample_confidence))
+sly.logger.info("quick_report: {}".format(quick_report))
 
 
-BG_COLOR = [0, 0, 0]
 api = sly.Api.from_env()
 
 widgets = []
@@ -53,16 +75,11 @@ meta = sly.ProjectMeta.from_json(meta_json)
 # list classes
 class_names = []
 class_colors = []
-class_indices = [] # 0 - for unlabeled area
-class_indices_colors = []
-_name_to_index = {}
+_name_to_index = {} # 0 - for unlabeled area
 for idx, obj_class in enumerate(meta.obj_classes):
     class_names.append(obj_class.name)
     class_colors.append(obj_class.color)
-    class_index = idx + 1
-    class_indices.append(class_index)
-    class_indices_colors.append([class_index, class_index, class_index])
-    _name_to_index[obj_class.name] = class_index
+    _name_to_index[obj_class.name] = idx + 1
 
 
 # list tags
@@ -89,91 +106,114 @@ if class_colors_notify != "":
     widgets.append(api.report.create_notification("Classes colors", class_colors_notify, sly.NotificationType.WARNING))
 
 
-all_images = []
-image_dataset = []
-for dataset in api.dataset.get_list(project.id):
-    if src_dataset_ids is not None and dataset.id not in src_dataset_ids:
-        continue
-    images = api.image.get_list(dataset.id)
-    all_images.extend(images)
-    temp_dataset = [dataset] * len(images)
-    image_dataset.extend(temp_dataset)
-img_ds_pairs = list(zip(all_images, image_dataset))
-if len(img_ds_pairs) == 0:
-    raise RuntimeError("0 items to process")
-
-if sample_ratio is not None:
-    random.shuffle(img_ds_pairs)
-    sample_count = max(int(len(img_ds_pairs) * sample_ratio), 1)
-    sample_count = min(len(img_ds_pairs), sample_count)
-    img_ds_pairs = img_ds_pairs[:sample_count]
-
-
-ds_to_images = defaultdict(list)
-ds_id_to_info = {}
-for image_info, dataset_info in img_ds_pairs:
-    ds_to_images[dataset_info.id].append(image_info)
-    ds_id_to_info[dataset_info.id] = dataset_info
-
-total_images_in_project = 0
-stats_area = []
-stats_count = []
-stats_img_tags = []
-
+datasets = [dataset for dataset in api.dataset.get_list(project.id)
+            if src_dataset_ids is None or dataset.id in src_dataset_ids]
 
-ds_progress = sly.Progress('Processing', total_cnt=len(img_ds_pairs))
-for dataset_id, dataset in ds_id_to_info.items():
-    images = ds_to_images[dataset.id]
 
-    for batch in sly.batched(images):
-        image_ids = [image_info.id for image_info in batch]
-        image_names = [image_info.name for image_info in batch]
+def publish_report(widgets):
+    report_id = api.report.create(team.id, "Project stats: {!r}".format(project_name), widgets)
+    print(api.report.url(report_id))
+    sly.logger.info('Report URL', extra={'report_url': api.report.url(report_id)})
+    sly.logger.info('REPORT_CREATED', extra={'event_type': sly.EventType.REPORT_CREATED, 'report_id': report_id})
 
-        ann_infos = api.annotation.download_batch(dataset.id, image_ids)
-        ann_jsons = [ann_info.annotation for ann_info in ann_infos]
 
-        for info, ann_json in zip(batch, ann_jsons):
-            ann = sly.Annotation.from_json(ann_json, meta)
-
-            render_img = np.zeros(ann.img_size + (3,), dtype=np.uint8)
-            render_img[:] = BG_COLOR
-            ann.draw(render_img)
-            # temp_area = sly.Annotation.stat_area(render_img, class_names, class_colors)
-
-            render_idx_rgb = np.zeros(ann.img_size+ (3,), dtype=np.uint8)
-            render_idx_rgb[:] = BG_COLOR
-            ann.draw_class_idx_rgb(render_idx_rgb, _name_to_index)
-            temp_area = sly.Annotation.stat_area(render_idx_rgb, class_names, class_indices_colors)
-
-            temp_count = ann.stat_class_count(class_names)
-            if len(tag_names) != 0:
-                temp_img_tags = ann.stat_img_tags(tag_names)
+if quick_report:
+    info_stats = InfoStats()
+    for dataset, images in list_datasets_images(api, datasets):
+        info_stats.add(dataset, images)
+    if info_stats.images_count == 0:
+        raise RuntimeError("0 items to process")
+    widgets.append(api.report.create_plotly(charts.dataset_figure(info_stats).to_json(),
+                                            "Labeled / unlabeled images",
+                                            "{} of {} images are labeled (by labels count of images)"
+                                            .format(info_stats.labeled_count, info_stats.images_count)
+                                            )
+                   )
+    widgets.append(api.report.create_plotly(charts.resolution_figure(info_stats.resolutions).to_json(),
+                                            "Images resolutions (height x width x channels)",
+                                            "How many different resolutions are in the project"
+                                            )
+                   )
+    publish_report(widgets)
+    sys.exit(0)
 
-            temp_area['id'] = info.id
-            temp_area['dataset'] = dataset.name
-            temp_area['name'] = '<a href="{0}" rel="noopener noreferrer" target="_blank">{1}</a>'\
-                                .format(api.image.url(team.id,
-                                                      workspace.id,
-                                                      project.id,
-                                                      dataset.id,
-                                                      info.id),
-                                        info.name)
+if sample_tolerance is not None and sample_ratio is not None:
+    sly.logger.warn("sample_ratio is ignored, sample_tolerance is defined")
+    sample_ratio = None
 
-            stats_area.append(temp_area)
-            stats_count.append(temp_count)
-            if len(tag_names) != 0:
-                stats_img_tags.append(temp_img_tags)
 
-        ds_progress.iters_done_report(len(batch))
-        total_images_in_project += len(batch)
+def sample_count(images_count):
+    # every dataset is sampled with sample_ratio (at least one image of a non-empty dataset)
+    if sample_ratio is None or images_count == 0:
+        return images_count
+    return min(max(int(images_count * sample_ratio), 1), images_count)
 
 
-def area_name(name):
-    return "{} [area %]".format(name)
+# images are not listed up front: datasets are processed as soon as they are listed (listing of the next ones
+# runs concurrently) and their image infos are dropped, expected number of images is taken from dataset infos
+images_to_process = sum(sample_count(dataset.images_count) for dataset in datasets)
+if images_to_process == 0:
+    raise RuntimeError("0 items to process")
 
+total_images_in_project = 0
 
-def count_name(name):
-    return "{} [count]".format(name)
+# per-image stats are kept in preallocated columns (float32 / int32 per value), not in per-image dicts
+image_stats = ImageStats(meta)
+stat_columns = image_stats.get_columns()
+float_columns = {'unlabeled area %', *(area_name(name) for name in class_names)}
+
+
+def format_name(image_id, image_name, dataset_id):
+    return '<a href="{0}" rel="noopener noreferrer" target="_blank">{1}</a>'\
+           .format(api.image.url(team.id, workspace.id, project.id, dataset_id, image_id), image_name)
+
+
+stats_table = StatsTable(stat_columns, float_columns, capacity=images_to_process, format_name=format_name)
+
+
+def process_batch(dataset, image_ids, image_names):
+    """calculates stats of the batch of images of one dataset, returns stat rows of the images"""
+    global total_images_in_project
+    ann_infos = api.annotation.download_batch(dataset.id, image_ids)
+    ann_jsons = [ann_info.annotation for ann_info in ann_infos]
+
+    rows = [row for row, _, _ in image_stats.calc_batch(ann_jsons)]
+    stats_table.append(image_ids, image_names, [dataset.id] * len(image_ids), [dataset.name] * len(image_ids), rows)
+
+    ds_progress.iters_done_report(len(image_ids))
+    total_images_in_project += len(image_ids)
+    return rows
+
+
+ds_progress = sly.Progress('Processing', total_cnt=images_to_process)
+tracker = None
+if sample_tolerance is not None:
+    # stratified random order across datasets needs all images, only their (id, name) are kept
+    ds_to_images = {}
+    ds_id_to_info = {}
+    for dataset, images in list_datasets_images(api, datasets):
+        ds_to_images[dataset.id] = [(image_info.id, image_info.name) for image_info in images]
+        ds_id_to_info[dataset.id] = dataset
+    population = sum(len(images) for images in ds_to_images.values())
+    tracker = ConvergenceTracker(class_names, population=population, confidence=sample_confidence,
+                                 area_tolerance=sample_tolerance, count_tolerance=sample_tolerance,
+                                 presence_tolerance=sample_tolerance)
+    for dataset_id, batch in stratified_batches(ds_to_images):
+        image_ids, image_names = zip(*batch)
+        for row in process_batch(ds_id_to_info[dataset_id], list(image_ids), list(image_names)):
+            classes_values = row[CLASSES_OFFSET:CLASSES_OFFSET + 2 * len(class_names)]
+            tracker.add(classes_values[0::2], classes_values[1::2])
+        if tracker.converged():
+            break
+    sly.logger.info("Sampling stopped: {} of {} images processed".format(tracker.samples, population))
+else:
+    for dataset, images in list_datasets_images(api, datasets):
+        if sample_ratio is not None:
+            images = random.sample(images, sample_count(len(images)))
+        for batch in sly.batched(images):
+            process_batch(dataset, [image_info.id for image_info in batch], [image_info.name for image_info in batch])
+if total_images_in_project == 0:
+    raise RuntimeError("0 items to process")
 
 
 def color_name(name, color):
@@ -181,63 +221,39 @@ def color_name(name, color):
 
 
 #@TODO: add fieald tags count
-def create_df(stats_area, stats_count, stats_img_tags, class_names, class_colors, tag_names, tag_colors):
-    if len(stats_area) != len(stats_count):
-        raise RuntimeError("len(stats_area) != len(stats_count)")
-
-    df_area = pd.read_json(json.dumps(stats_area, cls=sly._utils.NpEncoder), orient='records')
-    df_area['unlabeled area %'] = (df_area['unlabeled area'] * 100) / df_area['total area']
-    for name in class_names:
-        df_area[name] = (df_area[name] * 100) / df_area['total area']
-    df_area = df_area.drop(['total area'], axis=1)
-    df_area = df_area.rename(columns={name: area_name(name) for name in class_names})
-
-    df_count = pd.read_json(json.dumps(stats_count, cls=sly._utils.NpEncoder), orient='records')
-    df_count = df_count.rename(columns={name: count_name(name) for name in class_names})
-
-    df = pd.concat([df_area, df_count], axis=1)
-    df = df.round(1)
-
-    cols_ordered = ['id', 'name', 'dataset', 'height', 'width', 'channels', 'unlabeled area %', 'total count']
-    classes_cols = []
-    for name in class_names:
-        classes_cols.append(area_name(name))
-        classes_cols.append(count_name(name))
-
-    df = df[[*cols_ordered, *classes_cols]]
-
-    if len(stats_img_tags) != 0:
-        df_img_tags = pd.read_json(json.dumps(stats_img_tags, cls=sly._utils.NpEncoder), orient='records')
-
-        series = None
-        for tag_name in tag_names:
-            if series is None:
-                series = df_img_tags[tag_name].copy()
-            else:
-                series += df_img_tags[tag_name]
-
-        df_img_tags['any tag'] = series
-
-        df = pd.concat([df, df_img_tags], axis=1)
-
-    raw_df = df.copy()
-
-    class_with_color = {}
+def create_df(stats_table, class_names, class_colors, tag_names, tag_colors):
+    # built from the table columns directly, values are already rounded by StatsTable
+    df = stats_table.to_dataframe(format_names=True)
+    int_columns = [name for name in stats_table.stat_columns if name not in float_columns]
+    df[int_columns] = df[int_columns].astype(np.int64)
+
+    # columns are only renamed for the shown table, numeric data is shared with raw_df
+    raw_df = df
+    columns_names = {}
     for name, color in zip(class_names, class_colors):
-        class_with_color[area_name(name)] = color_name(area_name(name), sly.color.rgb2hex(color))
-        class_with_color[count_name(name)] = color_name(count_name(name), sly.color.rgb2hex(color))
-    df = df.rename(columns=class_with_color)
-
-    if len(stats_img_tags) != 0:
-        class_with_icon = {}
-        for name, color in zip(tag_names, tag_colors):
-            class_with_icon[name] = '<i class="zmdi zmdi-label" style="color:{};margin-right:3px"></i>{}'.format(sly.color.rgb2hex(color), name)
-        df = df.rename(columns=class_with_icon)
+        columns_names[area_name(name)] = color_name(area_name(name), sly.color.rgb2hex(color))
+        columns_names[count_name(name)] = color_name(count_name(name), sly.color.rgb2hex(color))
+    for name, color in zip(tag_names, tag_colors):
+        columns_names[name] = '<i class="zmdi zmdi-label" style="color:{};margin-right:3px"></i>{}'.format(sly.color.rgb2hex(color), name)
+    df = df.rename(columns=columns_names, copy=False)
 
     return df, raw_df
 
 
-df, raw_df = create_df(stats_area, stats_count, stats_img_tags, class_names, class_colors, tag_names, tag_colors)
+df, raw_df = create_df(stats_table, class_names, class_colors, tag_names, tag_colors)
+
+if tracker is not None:
+    # achieved margins: estimates are mean +- half-width with the requested confidence
+    widgets.append(api.report.create_table(pd.DataFrame(tracker.to_rows()),
+                                           "Sampling margins",
+                                           "{} of {} images are processed, {:.0f}% confidence intervals "
+                                           "(tolerance +-{}) of mean class area % and count over the images with "
+                                           "the class (as in the charts below) and % of images with the class; "
+                                           "means of the classes found on fewer than {} images may exceed it"
+                                           .format(tracker.samples, tracker.population, sample_confidence * 100,
+                                                   sample_tolerance, tracker.min_samples),
+                                           fix_columns=1)
+                   )
 
 widgets.append(api.report.create_table(df,
                                        "Images stats",
@@ -323,7 +339,7 @@ widgets.append(api.report.create_plotly(fig_with_without_count.to_json(),
                                         )
                )
 
-if len(stats_img_tags) != 0:
+if len(tag_names) != 0:
 
     col_tags_count = 'any tag'
 
@@ -384,10 +400,7 @@ widgets.append(api.report.create_plotly(pie_resolution.to_json(),
                    )
 
 
-report_id = api.report.create(team.id, "Project stats: {!r}".format(project_name), widgets)
-print(api.report.url(report_id))
-sly.logger.info('Report URL', extra={'report_url': api.report.url(report_id)})
-sly.logger.info('REPORT_CREATED', extra={'event_type': sly.EventType.REPORT_CREATED, 'report_id': report_id})
+publish_report(widgets)
 
 # from supervisely_lib.report.table import compile_report
 # html_div1 = po.plot(pie_resolution, output_type='div')
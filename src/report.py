@@ -0,0 +1,507 @@
+import threading
+import time
+from array import array
+from collections import OrderedDict, deque
+
+import supervisely_lib as sly
+
+import area
+import charts
+import shards
+from aggregator import StatsAggregator
+from cache import CACHE_DIR, StatsCache, meta_fingerprint
+from checkpoint import CHECKPOINT_DIR, Checkpoint
+from image_stats import EMPTY_COUNTER, MEMO_HITS_COUNTER, MEMO_MISSES_COUNTER, ImageStats, area_name, count_name
+from info_stats import InfoStats
+from instrumentation import Instrumentation
+from jobs import LookupCache
+from pipeline import AnnotationPrefetcher, list_datasets_images
+from pusher import DataPusher
+from table import StatsTable
+from workers import StatsPool
+
+
+def color_name(name, color):
+    return '<b style="display: inline-block; border-radius: 50%; background: {}; width: 8px; height: 8px"></b> {}'.format(sly.color.rgb2hex(color), name)
+
+
+def color_tag_name(name, color):
+    return '<i class="zmdi zmdi-label" style="color:{};margin-right:3px"></i>{}'.format(sly.color.rgb2hex(color), name)
+
+
+# per-image tables of the calculations by data field, pages are requested by "get_table_page" command;
+# table of the app UI project ("data") is always kept, of the other jobs - only MAX_JOB_TABLES latest ones
+_tables = OrderedDict()
+_tables_lock = threading.Lock()
+MAX_JOB_TABLES = 2
+
+# stop events of the running calculations, request_stop() sets them: calculations stop after the current
+# batches, save checkpoints and flush everything calculated so far
+_stop_events = set()
+_running_condition = threading.Condition()
+
+# project meta, team and workspace infos are reused by the next calculations of the app
+_lookups = LookupCache()
+
+
+def request_stop(timeout=60):
+    """asks running calculations to stop gracefully and waits (at most timeout seconds) until they are done"""
+    with _running_condition:
+        for stop_event in _stop_events:
+            stop_event.set()
+        return _running_condition.wait_for(lambda: len(_stop_events) == 0, timeout)
+
+
+def _set_table(field, table):
+    """replaces table of the field (None - drops it), old tables of the other jobs are evicted"""
+    with _tables_lock:
+        _tables.pop(field, None)
+        if table is None:
+            return
+        _tables[field] = table
+        job_fields = [name for name in _tables if name != "data"]
+        for name in job_fields[:max(len(job_fields) - MAX_JOB_TABLES, 0)]:
+            del _tables[name]
+            sly.logger.info("per-image table of {!r} is evicted".format(name))
+
+
+def table_page_payload(table: StatsTable, state):
+    page, total = table.query(page=state.get("tablePage", 1), per_page=state.get("perPage", 25),
+                              sort_column_idx=state.get("tableSortColumn"),
+                              sort_order=state.get("tableSortOrder", "asc"),
+                              filter_text=state.get("tableFilter"))
+    return {"tablePerImageStats": page, "tableTotalRows": total}
+
+
+def push_table_page(api: sly.Api, task_id, state, field="data"):
+    with _tables_lock:
+        table = _tables.get(field)
+    if table is None:
+        return
+    api.app.set_data(task_id, table_page_payload(table, state), field, append=True)
+
+
+def _push_failure(api: sly.Api, task_id, field, error):
+    try:
+        api.app.set_data(task_id, charts.failure_payload(error), field, append=True)
+    except Exception:
+        sly.logger.warn("failure of {!r} is not pushed".format(field), exc_info=True)
+
+
+def calculate_stats(api: sly.Api, task_id, project_id, state, field="data", lookups: LookupCache = None):
+    """
+    calculates stats of the project and pushes them to app data field (namespace of the calculation),
+    lookups - cache of meta/team/workspace shared between calculations (module-level one by default);
+    if the calculation fails, the error is pushed to the field ("error") and re-raised
+    """
+    # every job has its own stop event, so a stop request doesn't affect the next jobs of the app
+    stop_event = threading.Event()
+    with _running_condition:
+        _stop_events.add(stop_event)
+    try:
+        _calculate_stats(api, task_id, project_id, state, field, sly.take_with_default(lookups, _lookups),
+                         stop_event)
+    except Exception as e:
+        _push_failure(api, task_id, field, e)
+        raise
+    finally:
+        with _running_condition:
+            _stop_events.discard(stop_event)
+            _running_condition.notify_all()
+
+
+def _get_project(api: sly.Api, project_id, lookups: LookupCache):
+    """returns project, workspace, team infos, meta json and meta"""
+    project = api.project.get_info_by_id(project_id)
+    if project is None:
+        raise RuntimeError("Project ID={!r} not found".format(project_id))
+    if project.type != str(sly.ProjectType.IMAGES):
+        raise RuntimeError('Project {!r} has type {!r}. This script works only with {!r} projects'
+                           .format(project.name, project.type, str(sly.ProjectType.IMAGES)))
+
+    workspace = lookups.workspace(api, project.workspace_id)
+    team = lookups.team(api, workspace.team_id)
+
+    sly.logger.info("team: {}".format(team.name))
+    sly.logger.info("workspace: {}".format(workspace.name))
+    sly.logger.info("project: {}".format(project.name))
+
+    meta_json = lookups.meta_json(api, project)
+    return project, workspace, team, meta_json, sly.ProjectMeta.from_json(meta_json)
+
+
+def _stat_columns(meta: sly.ProjectMeta):
+    """UI names of the columns of compact rows from ImageStats.calc and names of the float ones"""
+    classes_cols = []
+    for obj_class in meta.obj_classes:
+        classes_cols.append(color_name(area_name(obj_class.name), obj_class.color))
+        classes_cols.append(color_name(count_name(obj_class.name), obj_class.color))
+    tags_cols = ['any tag']
+    for tag_meta in meta.tag_metas:
+        tags_cols.append(color_tag_name(tag_meta.name, tag_meta.color))
+
+    stat_cols = ['height', 'width', 'channels', 'unlabeled area %', 'total count', *classes_cols]
+    if len(meta.tag_metas) != 0:
+        stat_cols.extend(tags_cols)
+    return stat_cols, {'unlabeled area %', *classes_cols[0::2]}
+
+
+def _name_formatter(api: sly.Api, team, workspace, project):
+    def format_name(image_id, image_name, dataset_id):
+        return '<a href="{0}" rel="noopener noreferrer" target="_blank">{1}</a>' \
+            .format(api.image.url(team.id, workspace.id, project.id, dataset_id, image_id), image_name)
+    return format_name
+
+
+def _stats_settings(state):
+    # settings that change stat rows, they are part of the cache/checkpoint/shards fingerprint
+    return {"area_backend": state.get("areaBackend", area.RASTER), "approx_scale": state.get("approxScale"),
+            "approx_max_side": state.get("approxMaxSide")}
+
+
+def _table_columns_payload(meta):
+    # plain column names for sorting controls
+    table_columns = ['id', 'name', 'dataset', *ImageStats(meta).get_columns()]
+    return {"tableColumns": [{"value": idx, "label": name} for idx, name in enumerate(table_columns)]}
+
+
+def _calculate_stats(api: sly.Api, task_id, project_id, state, field, lookups, stop_event):
+    project, workspace, team, meta_json, meta = _get_project(api, project_id, lookups)
+
+    area_backend = state.get("areaBackend", area.RASTER)
+    approximate = area_backend == area.APPROXIMATE
+    workers = state.get("workers", 1)
+    max_pending_batches = state.get("maxPendingBatches", 2 * workers)
+    sly.logger.info("area backend: {}".format(area_backend))
+    sly.logger.info("workers: {}".format(workers))
+    area_error_bound = 0
+
+    class_names = [obj_class.name for obj_class in meta.obj_classes]
+    tag_names = [tag_meta.name for tag_meta in meta.tag_metas]
+    stat_cols, float_cols = _stat_columns(meta)
+
+    total_images_count = api.project.get_images_count(project.id)
+    per_image_table = state.get("perImageTable", True)
+    charts_refresh_sec = state.get("chartsRefreshSec", 10)
+    table_per_image_stats = None
+    if per_image_table:
+        # the whole table is kept here, UI gets only the requested pages
+        table_per_image_stats = StatsTable(stat_cols, float_cols, capacity=total_images_count,
+                                           format_name=_name_formatter(api, team, workspace, project))
+    _set_table(field, table_per_image_stats)
+    per_page = state.get("perPage", 25)
+    aggregator = StatsAggregator(class_names, tag_names)
+    charts_pushed_at = time.time()
+
+    instrumentation = Instrumentation(enabled=state.get("instrumentation", True),
+                                      slowest_count=state.get("instrumentationSlowest", 10))
+    instrumentation_refresh_sec = state.get("instrumentationRefreshSec", 5)
+    instrumentation_pushed_at = time.time()
+
+    pusher = DataPusher(api, task_id, field=field, interval_ms=state.get("pushIntervalMs", 1000),
+                        max_bytes=state.get("pushMaxBytes", 4 * 1024 * 1024),
+                        instrumentation=instrumentation)
+    # error / stop of the previous calculation of the field, area backend of this one
+    pusher.set({"error": None, "stopped": False, "areaApproximate": approximate})
+    if per_image_table:
+        pusher.set(_table_columns_payload(meta))
+
+    datasets = api.dataset.get_list(project.id)
+    shard_count = state.get("shardCount", 1)
+    shard_index = state.get("shardIndex", 0)
+    dataset_images = None
+    info_stats = None
+    if state.get("quickReport", True):
+        # overview charts from image infos only are shown before any annotation is downloaded; listed images
+        # are kept only for the shard selection (it needs all of them anyway), otherwise the full pass lists
+        # datasets again instead of keeping every image info of the project
+        info_stats = InfoStats()
+        if shard_count > 1:
+            dataset_images = []
+        for dataset, images in list_datasets_images(api, datasets, state.get("listConcurrency", 8), instrumentation):
+            info_stats.add(dataset, images)
+            if dataset_images is not None:
+                dataset_images.append((dataset, images))
+        for payload in charts.overview_payloads(info_stats):
+            pusher.set(payload)
+        pusher.set({"quickOnly": not state.get("fullPass", True)})
+        pusher.flush()
+        if not state.get("fullPass", True):
+            sly.logger.info("quick report: {} images, {} labeled, annotations are not downloaded"
+                            .format(info_stats.images_count, info_stats.labeled_count))
+            return
+
+    if shard_count > 1:
+        # only a part of the images is calculated here, partial result is saved for merge_shards
+        if dataset_images is None:
+            dataset_images = list(list_datasets_images(api, datasets, state.get("listConcurrency", 8),
+                                                       instrumentation))
+        dataset_images = shards.select_shard(dataset_images, shard_index, shard_count,
+                                             state.get("shardBy", shards.BY_HASH))
+        total_images_count = max(sum(len(images) for _, images in dataset_images), 1)
+        sly.logger.info("shard {} of {}: {} images".format(shard_index, shard_count, total_images_count))
+
+    def push_charts():
+        # resolutions of the overview (all images) are not replaced by the ones of the processed images
+        for payload in charts.summary_payloads(aggregator, total_images_count, approximate,
+                                               with_resolutions=info_stats is None):
+            if approximate:
+                payload["areaErrorBound"] = round(area_error_bound, 2)
+            pusher.set(payload)
+
+    def process_batch_results(dataset, batch, ds_progress, results):
+        nonlocal area_error_bound, charts_pushed_at, instrumentation_pushed_at
+        rows = []
+        objects = []
+        for row, area_error, image_objects in results:
+            area_error_bound = max(area_error_bound, area_error)
+            rows.append(row)
+            objects.extend(image_objects)
+
+        ds_progress.iters_done_report(len(batch))
+        instrumentation.add_images(len(batch))
+
+        # refresh table and progress
+        with instrumentation.stage("aggregate"):
+            aggregator.add(rows)
+            aggregator.add_objects(objects)
+            payload = {
+                "progress": int(aggregator.images_count / total_images_count * 100)
+            }
+            if per_image_table:
+                start, stop = table_per_image_stats.append([info.id for info in batch], [info.name for info in batch],
+                                                           [dataset.id] * len(batch), [dataset.name] * len(batch),
+                                                           rows)
+                payload["tableTotalRows"] = len(table_per_image_stats)
+                if start < per_page:
+                    # first page is shown while it's being filled, other pages are sent on request
+                    payload.update(table_page_payload(table_per_image_stats, {"perPage": per_page}))
+        if approximate:
+            payload["areaErrorBound"] = round(area_error_bound, 2)
+        if instrumentation.enabled and time.time() - instrumentation_pushed_at >= instrumentation_refresh_sec:
+            payload["instrumentation"] = instrumentation.to_dict()
+            instrumentation_pushed_at = time.time()
+        pusher.set(payload)
+        pusher.maybe_flush()
+
+        # summary charts are refreshed live during processing
+        if charts_refresh_sec is not None and time.time() - charts_pushed_at >= charts_refresh_sec:
+            push_charts()
+            charts_pushed_at = time.time()
+
+        if all_image_ids is not None:
+            all_image_ids.extend(info.id for info in batch)
+        if checkpoint is not None:
+            unsaved_image_ids.extend(info.id for info in batch)
+            if checkpoint.due():
+                save_checkpoint()
+
+    stats_settings = _stats_settings(state)
+    fingerprint = meta_fingerprint(meta, **stats_settings)
+    cache = None
+    if state.get("useCache", True):
+        cache = StatsCache(project.id, fingerprint, state.get("cacheDir", CACHE_DIR))
+        saved_sketches = cache.get_sketches()
+        if saved_sketches is not None and shard_count == 1:
+            # percentiles of the previous complete run are shown until the first charts refresh
+            previous = StatsAggregator(class_names, tag_names)
+            previous.load_sketches(saved_sketches)
+            pusher.set(charts.class_quantiles_payload(previous, previous=True))
+    # ids of the processed images are collected only for their consumers: all of them (compact int64 array)
+    # to evict deleted images from the cache, the ones not saved yet for the checkpoint log
+    all_image_ids = array("q") if cache is not None and shard_count == 1 else None
+    unsaved_image_ids = []
+    # table rows already in the checkpoint log, only the next ones are appended to it
+    saved_rows_count = 0
+
+    def save_checkpoint():
+        nonlocal saved_rows_count
+        rows_count = len(table_per_image_stats) if per_image_table else 0
+        state = {"aggregator": aggregator.to_dict(), "area_error_bound": area_error_bound,
+                 "with_table": per_image_table}
+        new_table = table_per_image_stats.to_arrays(saved_rows_count, rows_count) if per_image_table else None
+        checkpoint.save(state, unsaved_image_ids, new_table)
+        unsaved_image_ids.clear()
+        saved_rows_count = rows_count
+
+    checkpoint = None
+    resumed_ids = []
+    if state.get("checkpointSec") is not None:
+        checkpoint = Checkpoint(project.id, fingerprint, state.get("checkpointDir", CHECKPOINT_DIR),
+                                interval_sec=state["checkpointSec"],
+                                suffix="_shard_{}_of_{}".format(shard_index, shard_count) if shard_count > 1 else "")
+        resumed = checkpoint.load()
+        # table rows are restored only if they were saved (perImageTable was on), otherwise
+        # images are calculated again to fill the table
+        if resumed is not None and (not per_image_table or resumed[0]["with_table"]):
+            resumed_state, resumed_ids, resumed_tables = resumed
+            if all_image_ids is not None:
+                all_image_ids.extend(resumed_ids)
+            aggregator = StatsAggregator.from_dict(resumed_state["aggregator"])
+            area_error_bound = resumed_state["area_error_bound"]
+            if per_image_table:
+                for table_part in resumed_tables:
+                    table_per_image_stats.append(**table_part)
+            saved_rows_count = len(table_per_image_stats) if per_image_table else 0
+            sly.logger.info("resumed from checkpoint: {} images are already processed".format(len(resumed_ids)))
+            pusher.set({"resumedImages": len(resumed_ids),
+                        "progress": int(aggregator.images_count / total_images_count * 100)})
+            if per_image_table:
+                pusher.set({"tableTotalRows": len(table_per_image_stats),
+                            **table_page_payload(table_per_image_stats, {"perPage": per_page})})
+            push_charts()
+            pusher.flush()
+        elif resumed is not None:
+            # loaded log is continued by save(), so the snapshot that is not used is removed
+            checkpoint.remove()
+
+    def merge_results(batch, cached, future):
+        # calculated rows are only for not cached images, results are merged in the batch order
+        calculated = []
+        if future is not None:
+            calculated, worker_instrumentation = future.result()
+            instrumentation.merge(worker_instrumentation)
+        if cache is not None and len(calculated) != 0:
+            cache.put_many([info for info in batch if info.id not in cached], calculated)
+        calculated = iter(calculated)
+        return [cached[info.id] if info.id in cached else next(calculated) for info in batch]
+
+    # annotations are prefetched by download threads, batches are calculated by worker processes,
+    # results are consumed in submission order to keep per-dataset progress and table rows order
+    prefetcher = AnnotationPrefetcher(api, datasets,
+                                      download_threads=state.get("downloadThreads", 2),
+                                      queue_depth=state.get("prefetchDepth", 4),
+                                      list_concurrency=state.get("listConcurrency", 8),
+                                      cache=cache, raw_download=state.get("fastParse", True),
+                                      dataset_images=dataset_images, skip_ids=set(resumed_ids),
+                                      instrumentation=instrumentation)
+    # pending table rows and charts are pushed (and checkpoint is saved) even if processing fails or stopped
+    completed = False
+    stopped = False
+    try:
+        ds_progresses = {}
+        pending = deque()
+        with StatsPool(meta_json, workers, instrumentation_enabled=instrumentation.enabled,
+                       fast_parse=state.get("fastParse", True), mask_pool_mb=state.get("maskPoolMb", 256),
+                       memo_mb=state.get("annMemoMb", 64),
+                       **stats_settings) as pool:
+            for dataset, images_count, batch, ann_jsons, cached in prefetcher:
+                if stop_event.is_set():
+                    # batches in flight are consumed below, not submitted ones are skipped
+                    stopped = True
+                    break
+                if dataset.id not in ds_progresses:
+                    ds_progresses[dataset.id] = sly.Progress('Dataset {}'.format(dataset.name), total_cnt=images_count)
+                image_keys = [(info.id, info.name) for info in batch if info.id not in cached]
+                future = pool.submit(ann_jsons, image_keys) if len(ann_jsons) != 0 else None
+                pending.append((dataset, batch, ds_progresses[dataset.id], cached, future))
+
+                while len(pending) > max_pending_batches:
+                    dataset_, batch_, ds_progress_, cached_, future_ = pending.popleft()
+                    process_batch_results(dataset_, batch_, ds_progress_, merge_results(batch_, cached_, future_))
+
+            while len(pending) != 0:
+                dataset_, batch_, ds_progress_, cached_, future_ = pending.popleft()
+                process_batch_results(dataset_, batch_, ds_progress_, merge_results(batch_, cached_, future_))
+        completed = not stopped
+    finally:
+        if checkpoint is not None and not completed:
+            save_checkpoint()
+        pusher.flush()
+
+    if stopped:
+        sly.logger.info("calculation is stopped: {} images are processed".format(aggregator.images_count))
+        if cache is not None:
+            cache.close()
+        push_charts()
+        pusher.set({"stopped": True})
+        pusher.flush()
+        return
+
+    if checkpoint is not None:
+        checkpoint.remove()
+
+    if cache is not None:
+        cache.log_stats()
+        # shard sees only its part of the project, entries of the other images are not evicted
+        if shard_count == 1:
+            evicted = cache.evict_missing(all_image_ids)
+            sly.logger.info("stats cache: {} entries of deleted images are evicted".format(evicted))
+            cache.put_sketches(aggregator.sketches_to_dict())
+        cache.close()
+
+    if shard_count > 1:
+        path = shards.partial_path(state.get("shardDir", shards.SHARDS_DIR), project.id, shard_index, shard_count)
+        shards.save_partial(path, fingerprint, shard_index, shard_count, aggregator, area_error_bound,
+                            table_per_image_stats if state.get("shardTableRows", False) else None)
+        sly.logger.info("partial result of the shard is saved to {!r}".format(path))
+
+    if approximate:
+        sly.logger.info("approximate area: worst-case error estimate {:.2f} %".format(area_error_bound))
+    push_charts()
+
+    if instrumentation.enabled:
+        pusher.set({"instrumentation": instrumentation.to_dict()})
+        instrumentation.log()
+        _log_fast_paths(instrumentation)
+    pusher.flush()
+
+
+def _log_fast_paths(instrumentation):
+    # counters of ImageStats: images without objects and identical annotations are not drawn
+    counters = instrumentation.counters
+    empty = counters.get(EMPTY_COUNTER, 0)
+    hits, misses = counters.get(MEMO_HITS_COUNTER, 0), counters.get(MEMO_MISSES_COUNTER, 0)
+    calculated = empty + hits + misses
+    sly.logger.info("annotations fast paths: {} empty, {} memo hits, {} memo misses".format(empty, hits, misses),
+                    extra={
+                        "empty_rate": empty / calculated if calculated != 0 else 0,
+                        "memo_hit_rate": hits / (hits + misses) if hits + misses != 0 else 0
+                    })
+
+
+def merge_shards(api: sly.Api, task_id, project_id, state, field="data", lookups: LookupCache = None):
+    """
+    coordinator step of the sharded calculation: merges partial results of all state["shardCount"] shards
+    and pushes the same charts (and per-image table if shards saved their rows) as calculate_stats;
+    if merging fails, the error is pushed to the field ("error") and re-raised
+    """
+    try:
+        return _merge_shards(api, task_id, project_id, state, field, sly.take_with_default(lookups, _lookups))
+    except Exception as e:
+        _push_failure(api, task_id, field, e)
+        raise
+
+
+def _merge_shards(api: sly.Api, task_id, project_id, state, field, lookups):
+    project, workspace, team, meta_json, meta = _get_project(api, project_id, lookups)
+    shard_count = state["shardCount"]
+    shards_dir = state.get("shardDir", shards.SHARDS_DIR)
+    paths = [shards.partial_path(shards_dir, project.id, idx, shard_count) for idx in range(shard_count)]
+    fingerprint = meta_fingerprint(meta, **_stats_settings(state))
+    aggregator, area_error_bound, table_arrays = shards.merge_partials(paths, fingerprint=fingerprint)
+    sly.logger.info("{} shards are merged: {} images".format(shard_count, aggregator.images_count))
+    if state.get("useCache", True):
+        # sketches of the whole project are reused by the next runs (see StatsCache.get_sketches)
+        cache = StatsCache(project.id, fingerprint, state.get("cacheDir", CACHE_DIR))
+        cache.put_sketches(aggregator.sketches_to_dict())
+        cache.close()
+
+    approximate = state.get("areaBackend", area.RASTER) == area.APPROXIMATE
+    pusher = DataPusher(api, task_id, field=field)
+    _set_table(field, None)
+    if table_arrays is not None:
+        stat_cols, float_cols = _stat_columns(meta)
+        table = StatsTable(stat_cols, float_cols, capacity=len(table_arrays["ids"]),
+                           format_name=_name_formatter(api, team, workspace, project))
+        table.append(**table_arrays)
+        _set_table(field, table)
+        pusher.set(_table_columns_payload(meta))
+        pusher.set(table_page_payload(table, state))
+    for payload in charts.summary_payloads(aggregator, max(aggregator.images_count, 1), approximate):
+        if approximate:
+            payload["areaErrorBound"] = round(area_error_bound, 2)
+        pusher.set(payload)
+    pusher.set({"progress": 100, "error": None, "stopped": False, "areaApproximate": approximate})
+    pusher.flush()
+    return aggregator
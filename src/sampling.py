@@ -0,0 +1,138 @@
+import heapq
+import math
+import random
+from statistics import NormalDist
+
+import numpy as np
+
+
+def stratified_batches(ds_to_images, batch_size=50, seed=None):
+    """
+    Streams (dataset_id, batch of image infos) in random order: images of every dataset are shuffled and
+    datasets are interleaved proportionally to their size, so any prefix of the stream is a stratified sample
+    """
+    rnd = random.Random(seed)
+    queues = {}
+    heap = []  # (fraction of dataset already taken, dataset_id)
+    for dataset_id, images in ds_to_images.items():
+        if len(images) == 0:
+            continue
+        images = list(images)
+        rnd.shuffle(images)
+        queues[dataset_id] = images
+        heap.append((0.0, dataset_id))
+    heapq.heapify(heap)
+
+    taken = {dataset_id: 0 for dataset_id in queues}
+    while len(heap) != 0:
+        _, dataset_id = heapq.heappop(heap)
+        images = queues[dataset_id]
+        # small datasets get proportionally small batches, so all strata are sampled at the same rate
+        size = min(batch_size, max(1, int(math.ceil(len(images) * batch_size / _largest(queues)))))
+        batch = images[taken[dataset_id]:taken[dataset_id] + size]
+        taken[dataset_id] += len(batch)
+        yield dataset_id, batch
+        if taken[dataset_id] < len(images):
+            heapq.heappush(heap, (taken[dataset_id] / len(images), dataset_id))
+
+
+def _largest(queues):
+    return max(len(images) for images in queues.values())
+
+
+class _RunningStats:
+    """Welford's running mean/variance of several variables at once, every variable has its own number of values"""
+
+    def __init__(self, size):
+        self.n = np.zeros(size, dtype=np.int64)
+        self.mean = np.zeros(size, dtype=np.float64)
+        self._m2 = np.zeros(size, dtype=np.float64)
+
+    def add(self, values, mask=None):
+        """mask - variables that get the value (all by default)"""
+        values = np.asarray(values, dtype=np.float64)
+        mask = np.ones(len(values), dtype=bool) if mask is None else np.asarray(mask, dtype=bool)
+        self.n += mask
+        delta = np.where(mask, values - self.mean, 0.0)
+        self.mean += delta / np.maximum(self.n, 1)
+        self._m2 += delta * (values - self.mean)
+
+    def variance(self):
+        variance = np.full(len(self.mean), np.inf)
+        defined = self.n >= 2
+        variance[defined] = self._m2[defined] / (self.n[defined] - 1)
+        return variance
+
+
+class ConvergenceTracker:
+    """
+    Running confidence intervals of per-class mean area % and mean objects count over the images with the class
+    (the non-zero means shown in the report) and of presence rate (% of images with the class). Half-widths use
+    finite population correction (number of the images with the class is estimated from the presence rate), so
+    they shrink to 0 when the whole project is processed. converged() - when every half-width is below its
+    tolerance; means of the classes found on fewer than min_samples images are not required to converge
+    """
+
+    def __init__(self, class_names, population, confidence=0.95, area_tolerance=0.5, count_tolerance=0.5,
+                 presence_tolerance=1.0, min_samples=30):
+        self.class_names = list(class_names)
+        self.population = population
+        self.confidence = confidence
+        self.tolerances = {"area": area_tolerance, "count": count_tolerance, "presence": presence_tolerance}
+        self.min_samples = min_samples
+        self.samples = 0
+        self._z = NormalDist().inv_cdf((1 + confidence) / 2)
+        self._stats = {name: _RunningStats(len(self.class_names)) for name in self.tolerances}
+
+    def add(self, areas_percent, counts):
+        """per-image values for every class (in class_names order)"""
+        counts = np.asarray(counts, dtype=np.float64)
+        present = counts > 0
+        self.samples += 1
+        self._stats["area"].add(areas_percent, present)
+        self._stats["count"].add(counts, present)
+        self._stats["presence"].add(present * 100.0)
+
+    def _half_widths(self, stats, population):
+        # population - per class, fpc is 0 when all of it is processed (even if variance is not defined)
+        n = stats.n
+        population = np.maximum(population, n)
+        fpc = np.sqrt(np.clip(population - n, 0, None) / np.maximum(population - 1, 1))
+        with np.errstate(invalid="ignore"):
+            half_widths = self._z * np.sqrt(stats.variance() / np.maximum(n, 1)) * fpc
+        return np.where(fpc == 0, 0.0, half_widths)
+
+    def margins(self):
+        """{metric: (means, half-widths, number of values)}"""
+        presence = self._stats["presence"]
+        population_with_class = presence.mean / 100 * self.population
+        margins = {}
+        for name, stats in self._stats.items():
+            population = np.full(len(self.class_names), self.population) if name == "presence" \
+                else population_with_class
+            margins[name] = (stats.mean, self._half_widths(stats, population), stats.n)
+        return margins
+
+    def converged(self):
+        if self.samples >= self.population:
+            return True
+        if self.samples < self.min_samples:
+            return False
+        for name, (_, half_widths, n) in self.margins().items():
+            required = n >= self.min_samples
+            if not np.all(half_widths[required] <= self.tolerances[name]):
+                return False
+        return True
+
+    def to_rows(self):
+        margins = self.margins()
+        rows = []
+        for idx, name in enumerate(self.class_names):
+            row = {"class": name, "images with class": int(margins["area"][2][idx])}
+            for metric, (means, half_widths, _) in margins.items():
+                half_width = float(half_widths[idx])
+                row["mean {}".format(metric)] = round(float(means[idx]), 2)
+                # not defined for classes found on less than 2 images
+                row["± {}".format(metric)] = round(half_width, 2) if math.isfinite(half_width) else None
+            rows.append(row)
+        return rows
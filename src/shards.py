@@ -0,0 +1,86 @@
+import json
+import os
+import zlib
+
+import numpy as np
+
+from aggregator import StatsAggregator
+
+SHARDS_DIR = os.path.join(os.environ.get("SLY_APP_DATA_DIR", os.path.expanduser("~")), "project_stats_shards")
+
+# how images are split between shards (state["shardBy"])
+BY_DATASET = "dataset"
+BY_HASH = "hash"
+
+
+def _shard_of(key, shard_count):
+    # stable between processes and runs (unlike hash())
+    return zlib.crc32(str(key).encode('utf-8')) % shard_count
+
+
+def select_shard(dataset_images, shard_index, shard_count, shard_by=BY_HASH):
+    """[(dataset, images)] of the shard: whole datasets (BY_DATASET) or images by hash of their id (BY_HASH)"""
+    if shard_by not in [BY_DATASET, BY_HASH]:
+        raise ValueError("Unknown shardBy {!r}, supported: {}".format(shard_by, [BY_DATASET, BY_HASH]))
+    if shard_by == BY_DATASET:
+        return [(dataset, images) for dataset, images in dataset_images
+                if _shard_of(dataset.id, shard_count) == shard_index]
+    return [(dataset, [info for info in images if _shard_of(info.id, shard_count) == shard_index])
+            for dataset, images in dataset_images]
+
+
+def partial_path(shards_dir, project_id, shard_index, shard_count):
+    return os.path.join(shards_dir, "project_{}_shard_{}_of_{}.json".format(project_id, shard_index, shard_count))
+
+
+def save_partial(path, fingerprint, shard_index, shard_count, aggregator: StatsAggregator, area_error_bound,
+                 table=None):
+    """partial result of one shard: aggregator state (+ per-image table rows if table is given)"""
+    data = {
+        "fingerprint": fingerprint,
+        "shard_index": shard_index,
+        "shard_count": shard_count,
+        "aggregator": aggregator.to_dict(),
+        "area_error_bound": area_error_bound,
+        "table": None
+    }
+    if table is not None:
+        arrays = table.to_arrays()
+        data["table"] = {key: values.tolist() for key, values in arrays.items()}
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def merge_partials(paths, fingerprint=None):
+    """
+    returns (aggregator, area error bound, table arrays or None) merged from the partial results of all shards,
+    table rows are merged only if every shard saved them; fingerprint - expected meta fingerprint of the shards
+    """
+    partials = []
+    for path in paths:
+        if not os.path.isfile(path):
+            raise RuntimeError("Partial result {!r} not found, not all shards are finished".format(path))
+        with open(path) as f:
+            partials.append(json.load(f))
+    fingerprints = set(partial["fingerprint"] for partial in partials)
+    if len(fingerprints) > 1 or (fingerprint is not None and fingerprints != {fingerprint}):
+        raise RuntimeError("Shards were calculated with different project meta or stats settings")
+
+    aggregator = StatsAggregator.from_dict(partials[0]["aggregator"])
+    for partial in partials[1:]:
+        aggregator.merge(StatsAggregator.from_dict(partial["aggregator"]))
+    area_error_bound = max(partial["area_error_bound"] for partial in partials)
+
+    table = None
+    if all(partial["table"] is not None for partial in partials):
+        table = {key: [] for key in partials[0]["table"]}
+        for partial in partials:
+            for key, values in partial["table"].items():
+                table[key].extend(values)
+        if len(table["ids"]) == 0:
+            return aggregator, area_error_bound, None
+        table["rows"] = np.array(table["rows"], dtype=np.float64).reshape(len(table["ids"]), -1)
+    return aggregator, area_error_bound, table
@@ -0,0 +1,89 @@
+import math
+import random
+
+import numpy as np
+
+# capacity of the level below is CAPACITY_DECAY of the level above (KLL)
+CAPACITY_DECAY = 2 / 3
+MIN_CAPACITY = 2
+
+
+class QuantileSketch:
+    """
+    Mergeable KLL quantile sketch: items of level h have weight 2^h, full levels are compacted by sorting and
+    promoting every other item to the next level. Size is O(k) items whatever the number of values,
+    rank error is ~1.7 / k (k=200 -> ~1 % of the rank). Sketches of the same k can be merged (shards,
+    checkpoints), to_dict / from_dict - json-serializable state
+    """
+
+    def __init__(self, k=200, seed=None):
+        self.k = k
+        self.n = 0
+        self.levels = [np.empty(0, dtype=np.float64)]
+        self._rnd = random.Random(seed)
+
+    def _capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(int(math.ceil(self.k * CAPACITY_DECAY ** depth)), MIN_CAPACITY)
+
+    def _compact(self, level):
+        items = np.sort(self.levels[level])
+        # odd item stays on its level, the rest is halved with random offset
+        keep, items = items[:len(items) % 2], items[len(items) % 2:]
+        promoted = items[self._rnd.randint(0, 1)::2]
+        if level + 1 == len(self.levels):
+            self.levels.append(np.empty(0, dtype=np.float64))
+        self.levels[level] = keep
+        self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+
+    def _compress(self):
+        # capacities depend on the number of levels, so compaction is repeated from the bottom until all fit
+        level = 0
+        while level < len(self.levels):
+            if len(self.levels[level]) > self._capacity(level):
+                self._compact(level)
+                level = 0
+            else:
+                level += 1
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if len(values) == 0:
+            return
+        self.n += len(values)
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+
+    def merge(self, other):
+        if other.k != self.k:
+            raise ValueError("Sketches of different k can't be merged")
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0, dtype=np.float64))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.n += other.n
+        self._compress()
+        return self
+
+    def quantiles(self, qs):
+        """approximate values of quantiles qs (0..1), nan if the sketch is empty"""
+        qs = np.asarray(qs, dtype=np.float64)
+        items = np.concatenate(self.levels)
+        if len(items) == 0:
+            return np.full(len(qs), np.nan)
+        weights = np.concatenate([np.full(len(level_items), 2 ** level, dtype=np.float64)
+                                  for level, level_items in enumerate(self.levels)])
+        order = np.argsort(items, kind='stable')
+        items, cumulative = items[order], np.cumsum(weights[order])
+        idx = np.searchsorted(cumulative, qs * cumulative[-1], side='left')
+        return items[np.minimum(idx, len(items) - 1)]
+
+    def to_dict(self):
+        return {"k": self.k, "n": self.n, "levels": [items.tolist() for items in self.levels]}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(k=data["k"])
+        sketch.n = data["n"]
+        sketch.levels = [np.array(items, dtype=np.float64) for items in data["levels"]]
+        return sketch
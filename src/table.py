@@ -0,0 +1,165 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+# values are rounded as the table is shown in UI (previously it was done with df.round(1))
+DECIMALS = 1
+
+# stat columns dtypes: rounded area % fit float32, counts, tags and sizes - int32
+FLOAT_DTYPE = np.float32
+INT_DTYPE = np.int32
+
+
+class StatsTable:
+    """
+    Preallocated columnar store of per-image stats: id/name/dataset columns + one contiguous array of its dtype
+    (FLOAT_DTYPE for float_columns, INT_DTYPE for the rest) for every column of ImageStats rows.
+    Produces 'split'-orient payloads for UI directly (the whole table is kept only here, UI gets the requested
+    page, see query) and the final DataFrame without JSON round trips.
+    format_name(image_id, image_name, dataset_id) - how name is shown in UI (e.g. link), called only for sent rows
+    """
+
+    def __init__(self, stat_columns, float_columns, capacity, format_name=None):
+        self.stat_columns = list(stat_columns)
+        self.columns = ['id', 'name', 'dataset', *self.stat_columns]
+        self.format_name = format_name
+        self._dtypes = [FLOAT_DTYPE if name in float_columns else INT_DTYPE for name in self.stat_columns]
+        self.size = 0
+        self._order_cache = None  # (key, indices) of the last query
+        self._lock = threading.Lock()  # pages are requested by app commands while the table is being filled
+
+        capacity = max(capacity, 1)
+        self._ids = np.empty(capacity, dtype=np.int64)
+        self._names = np.empty(capacity, dtype=object)
+        self._dataset_ids = np.empty(capacity, dtype=np.int64)
+        self._datasets = np.empty(capacity, dtype=object)
+        self._values = [np.empty(capacity, dtype=dtype) for dtype in self._dtypes]
+
+    def __len__(self):
+        return self.size
+
+    def _reserve(self, count):
+        capacity = len(self._ids)
+        if self.size + count <= capacity:
+            return
+        new_capacity = max(self.size + count, 2 * capacity)
+        def grown(old):
+            new = np.empty(new_capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            return new
+
+        for field in ['_ids', '_names', '_dataset_ids', '_datasets']:
+            setattr(self, field, grown(getattr(self, field)))
+        self._values = [grown(column) for column in self._values]
+
+    def append(self, ids, names, dataset_ids, datasets, rows):
+        """appends rows (lists of numbers in stat_columns order), returns slice of the appended rows"""
+        count = len(ids)
+        with self._lock:
+            self._reserve(count)
+            start, stop = self.size, self.size + count
+            self._ids[start:stop] = ids
+            self._names[start:stop] = names
+            self._dataset_ids[start:stop] = dataset_ids
+            self._datasets[start:stop] = datasets
+            if count != 0:
+                rows = np.round(np.asarray(rows, dtype=np.float64), DECIMALS)
+                for column, values in zip(self._values, rows.T):
+                    column[start:stop] = values
+            self.size = stop
+        return start, stop
+
+    def _column_lists(self, rows):
+        ids = self._ids[rows].tolist()
+        names = self._names[rows].tolist()
+        if self.format_name is not None:
+            names = [self.format_name(image_id, name, dataset_id)
+                     for image_id, name, dataset_id in zip(ids, names, self._dataset_ids[rows].tolist())]
+        columns = [ids, names, self._datasets[rows].tolist()]
+        for column in self._values:
+            columns.append(self._float64(column[rows]).tolist())
+        return columns
+
+    @staticmethod
+    def _float64(values):
+        # float32 12.3 is 12.300000190734863 in float64, so values are rounded again; ints are kept as is
+        if values.dtype == FLOAT_DTYPE:
+            return np.round(values.astype(np.float64), DECIMALS)
+        return values
+
+    def _split(self, rows, index):
+        # same structure as json.loads(df.to_json(orient='split'))
+        return {
+            "columns": self.columns,
+            "index": index,
+            "data": [list(row) for row in zip(*self._column_lists(rows))]
+        }
+
+    def _ordered_rows(self, sort_column_idx, sort_order, filter_text):
+        # order of the filtered rows is cached while the table doesn't change, so paging is cheap
+        key = (self.size, sort_column_idx, sort_order, filter_text)
+        if self._order_cache is not None and self._order_cache[0] == key:
+            return self._order_cache[1]
+
+        rows = np.arange(self.size)
+        if filter_text:
+            filter_text = filter_text.lower()
+            matched = [filter_text in name.lower() or filter_text in dataset.lower()
+                       for name, dataset in zip(self._names[:self.size], self._datasets[:self.size])]
+            rows = rows[np.array(matched, dtype=bool)]
+
+        if sort_column_idx is not None:
+            if sort_column_idx == 0:
+                keys = self._ids[rows]
+            elif sort_column_idx == 1:
+                keys = self._names[rows].astype(str)
+            elif sort_column_idx == 2:
+                keys = self._datasets[rows].astype(str)
+            else:
+                keys = self._values[sort_column_idx - 3][rows]
+            rows = rows[np.argsort(keys, kind='stable')]
+            if sort_order == "desc":
+                rows = rows[::-1]
+
+        self._order_cache = (key, rows)
+        return rows
+
+    def query(self, page=1, per_page=25, sort_column_idx=None, sort_order="asc", filter_text=None):
+        """
+        returns (split payload of the requested page, number of rows matched the filter); page is 1-based,
+        sort_column_idx - index in self.columns, filter_text - substring of image or dataset name
+        """
+        with self._lock:
+            rows = self._ordered_rows(sort_column_idx, sort_order, filter_text)
+            start = max(page - 1, 0) * per_page
+            page_rows = rows[start:start + per_page]
+            return self._split(page_rows, page_rows.tolist()), len(rows)
+
+    def to_arrays(self, start=0, stop=None):
+        """
+        copies of the filled columns (rows [start, stop)), stat columns as float64 "rows" block;
+        table.append(**other.to_arrays()) restores rows in another table
+        """
+        with self._lock:
+            rows = slice(start, self.size if stop is None else stop)
+            return {
+                "ids": self._ids[rows].copy(),
+                "names": self._names[rows].copy(),
+                "dataset_ids": self._dataset_ids[rows].copy(),
+                "datasets": self._datasets[rows].copy(),
+                "rows": np.stack([self._float64(column[rows]) for column in self._values], axis=1).astype(np.float64),
+            }
+
+    def to_dataframe(self, format_names=False):
+        # int columns are passed as views, float ones are rounded float64 (as they are shown in UI)
+        df = pd.DataFrame({name: self._float64(column[:self.size])
+                           for name, column in zip(self.stat_columns, self._values)}, copy=False)
+        df.insert(0, 'dataset', self._datasets[:self.size])
+        names = self._names[:self.size]
+        if format_names and self.format_name is not None:
+            names = [self.format_name(image_id, name, dataset_id) for image_id, name, dataset_id
+                     in zip(self._ids[:self.size].tolist(), names.tolist(), self._dataset_ids[:self.size].tolist())]
+        df.insert(0, 'name', names)
+        df.insert(0, 'id', self._ids[:self.size])
+        return df
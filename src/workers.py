@@ -0,0 +1,74 @@
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import supervisely_lib as sly
+
+from image_stats import ImageStats
+from instrumentation import Instrumentation
+
+# calculator of the worker process, project meta is shipped to every worker only once (in initializer);
+# it's used only in child processes, calculations in the app process keep their own (see StatsPool)
+_image_stats = None
+
+
+def _create_image_stats(meta_json, stats_kwargs, instrumentation_enabled):
+    return ImageStats(sly.ProjectMeta.from_json(meta_json), **stats_kwargs,
+                      instrumentation=Instrumentation(enabled=instrumentation_enabled))
+
+
+def _init_worker(meta_json, stats_kwargs, instrumentation_enabled):
+    global _image_stats
+    _image_stats = _create_image_stats(meta_json, stats_kwargs, instrumentation_enabled)
+
+
+def _calc_batch_with(image_stats, ann_jsons, image_keys):
+    # instrumentation of the batch is returned together with the rows and merged in the main process
+    results = image_stats.calc_batch(ann_jsons, image_keys)
+    return results, image_stats.instrumentation.snapshot(reset=True)
+
+
+def _calc_batch(ann_jsons, image_keys):
+    return _calc_batch_with(_image_stats, ann_jsons, image_keys)
+
+
+class StatsPool:
+    """
+    Calculates stat rows for batches of annotations in N worker processes (workers <= 1 - in the current
+    process). submit() returns futures of (results, instrumentation snapshot), so caller can keep several
+    batches in flight and consume them in order
+    """
+
+    def __init__(self, meta_json, workers=1, instrumentation_enabled=False, **stats_kwargs):
+        self.workers = workers
+        self._executor = None
+        self._image_stats = None
+        if workers > 1:
+            # workers are started while download/listing threads (and other jobs) are running, fork of
+            # a multi-threaded process may deadlock children on locks held by those threads
+            mp_context = multiprocessing.get_context("forkserver")
+            # children are forked from the server with the calculation modules already imported
+            mp_context.set_forkserver_preload(["workers"])
+            self._executor = ProcessPoolExecutor(max_workers=workers, mp_context=mp_context,
+                                                 initializer=_init_worker,
+                                                 initargs=(meta_json, stats_kwargs, instrumentation_enabled))
+        else:
+            # several calculations may run in threads of the app at once, so every pool has its own calculator
+            self._image_stats = _create_image_stats(meta_json, stats_kwargs, instrumentation_enabled)
+
+    def submit(self, ann_jsons, image_keys=None):
+        if self._executor is not None:
+            return self._executor.submit(_calc_batch, ann_jsons, image_keys)
+        future = Future()
+        future.set_result(_calc_batch_with(self._image_stats, ann_jsons, image_keys))
+        return future
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()